@@ -0,0 +1,84 @@
+"""Control-plane commands fanned out over many nodes at once, from a single asyncio event loop.
+
+Every node answers for itself through /INFO (its pid, ports origin & peers), so operating the network only needs
+the IDs of a few live nodes to start from: the rest are discovered by crawling their peer lists, one concurrent
+wave of queries per hop. Each command then reaches all of its nodes concurrently, so it takes about as long on a
+network of thousands of nodes as on a handful.
+"""
+
+import asyncio, json
+
+from gossip.constants import LOCALHOST, PORTS_ORIGIN, ADMIN_MAX_CONNECTIONS, ADMIN_TIMEOUT
+
+
+class AdminClient:
+
+    def __init__(self, hostname=LOCALHOST, ports_origin=PORTS_ORIGIN, max_connections=ADMIN_MAX_CONNECTIONS,
+                 timeout=ADMIN_TIMEOUT):
+        self.hostname = hostname
+        self.ports_origin = ports_origin
+        self.max_connections = max_connections
+        self.timeout = timeout
+
+    def discover(self, seed_ids):
+        """The /INFO of every live node reachable from the seed nodes, by node ID."""
+        return asyncio.run(self._discover(seed_ids))
+
+    def query(self, node_ids, cmd):
+        """Send a command to every node, and return their responses by node ID; unreachable nodes are left out."""
+        return asyncio.run(self._fan_out({node_id: cmd for node_id in node_ids}, get_responses=True))
+
+    def stop(self, node_ids):
+        """Shut every node down; returns the IDs of those reached."""
+        return list(asyncio.run(self._fan_out({node_id: "/SHUTDOWN:" for node_id in node_ids})))
+
+    def remove(self, node_ids):
+        """Shut the nodes down, and have each of their remaining peers drop them; returns the IDs of those reached."""
+        return asyncio.run(self._remove(set(node_ids)))
+
+    def reconnect(self, node_id, peer_ids):
+        """Connect the node with each of the given nodes, both ways."""
+        cmds = [(node_id, f"/ADD:{peer_id}") for peer_id in peer_ids] + [(peer_id, f"/ADD:{node_id}") for peer_id in peer_ids]
+        asyncio.run(self._send_all(cmds))
+
+    def list_peers(self, node_ids):
+        """The [id, address] of the peers of every node, by node ID."""
+        return {node_id: info["peers"] for node_id, info in self.query(node_ids, "/INFO:").items()}
+
+    async def _discover(self, seed_ids):
+        infos, wave = {}, set(seed_ids)
+        while wave:
+            wave_infos = await self._fan_out({node_id: "/INFO:" for node_id in wave}, get_responses=True)
+            infos.update(wave_infos)
+            seen = infos.keys() | wave
+            wave = {peer_id for info in wave_infos.values() for peer_id, _ in info["peers"] if peer_id not in seen}
+        return infos
+
+    async def _remove(self, node_ids):
+        infos = await self._fan_out({node_id: "/INFO:" for node_id in node_ids}, get_responses=True)
+        cmds = [(node_id, "/SHUTDOWN:") for node_id in infos]
+        cmds += [(peer_id, f"/REMOVE:{node_id}") for node_id, info in infos.items()
+                 for peer_id, _ in info["peers"] if peer_id not in node_ids]
+        await self._send_all(cmds)
+        return list(infos)
+
+    async def _fan_out(self, node_cmds, get_responses=False):
+        results = await self._send_all(list(node_cmds.items()), get_responses)
+        return {node_id: res for node_id, res in zip(node_cmds, results) if not isinstance(res, Exception)}
+
+    async def _send_all(self, cmds, get_responses=False):
+        slots = asyncio.Semaphore(self.max_connections)  # bound to this run's event loop
+        return await asyncio.gather(*(self._send(slots, node_id, cmd, get_responses) for node_id, cmd in cmds),
+            return_exceptions=True)     # an unreachable node must not fail the command on all the others
+
+    async def _send(self, slots, node_id, cmd, get_response):
+        async with slots:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.hostname, self.ports_origin + int(node_id)), timeout=self.timeout)
+            try:
+                writer.write(f"{cmd}\n".encode())
+                writer.write_eof()  # one-shot connection, like GossipClient's
+                response = await asyncio.wait_for(reader.read(), timeout=self.timeout)
+                return json.loads(response) if get_response else None
+            finally:
+                writer.close()
@@ -0,0 +1,248 @@
+import asyncio, time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from functools import partial
+
+import gossip.wire as wire
+from gossip.server import ServerSettings, GossipServer, GossipCommandProcessor
+from gossip.constants import ASYNC_MAX_INFLIGHT_RELAYS, ASYNC_MAX_LINE_BYTES, POOL_CONNECT_TIMEOUT, OUTBOUND_SEND_TIMEOUT, \
+    SERVER_LISTEN_BACKLOG
+
+
+@dataclass
+class AsyncServerSettings(ServerSettings):
+    links:      dict = field(init=False, repr=False)    # peer ID -> AsyncPeerLink, opened on the first relay to it
+    loop:       asyncio.AbstractEventLoop = field(init=False, repr=False)
+
+    def __post_init__(self):
+        super().__post_init__()
+        self.links = {}
+        self.loop = None    # the event loop the server runs on, once it listens
+
+    def remove_peer(self, node_id):
+        super().remove_peer(node_id)
+        link = self.links.pop(node_id, None)
+        if link is not None:
+            # peers are also removed by the failure detector's thread, while links belong to the event loop
+            if self.loop is not None and not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(link._close)
+            else:
+                link._close()
+
+
+class AsyncGossipServer(GossipServer):
+    """A gossip server running on an asyncio event loop instead of a thread per connection."""
+
+    settings_class = AsyncServerSettings
+
+    def __init__(self, server_address, peer_addrs, **settings_opts):
+        super().__init__(server_address, peer_addrs, **settings_opts)
+        self.relay_failures = 0
+
+    def start(self):
+        self._print_start_banner()
+        self._start_background_tasks()
+        asyncio.run(self.serve_forever())
+
+    async def serve_forever(self):
+        await self.listen()
+        await self.wait_closed()
+
+    async def listen(self):
+        """Start accepting connections on the running event loop, which may serve many other servers too."""
+        self.ss.loop = asyncio.get_running_loop()
+        self._relay_slots = asyncio.Semaphore(ASYNC_MAX_INFLIGHT_RELAYS)
+        self._closed = asyncio.Event()
+        self._writers = set()
+        self._listener = await asyncio.start_server(self._handle_connection, *self.host_port_tup, reuse_address=True,
+            backlog=SERVER_LISTEN_BACKLOG, limit=ASYNC_MAX_LINE_BYTES)
+
+    async def wait_closed(self):
+        await self._closed.wait()
+
+    def close(self):
+        # pooled peer connections outlive the listener, so they're closed too, for the node to be gone from the network
+        self._listener.close()
+        for writer in list(self._writers):
+            writer.close()
+        for link in list(self.ss.links.values()):
+            link._close()
+        self._stop_background_tasks()
+        self._closed.set()
+
+    async def _handle_connection(self, reader, writer):
+        conn = AsyncGossipConnection(self, writer)
+        self._writers.add(writer)
+        try:
+            while raw_line := await reader.readline():
+                line = raw_line.strip()
+                if not line:
+                    continue
+                if line == wire.PROTO_BINARY_REQUEST.strip():
+                    writer.write(wire.PROTO_BINARY_ACK)
+                    await self._handle_binary(conn, reader)
+                    break
+                conn._proc_cmd_line(line.decode(), len(raw_line))
+                await conn.flush()  # don't read the next command until its relays are out: this is our backpressure
+        except (ConnectionError, ValueError):  # ValueError: a line longer than ASYNC_MAX_LINE_BYTES
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _handle_binary(self, conn, reader):
+        while (frame := await wire.read_frame_async(reader)) is not None:
+            conn._proc_frame(*frame)
+            await conn.flush()
+
+    def get_link(self, peer):
+        """The link to the peer; None if it's no longer a peer, e.g. removed while its relays were being made."""
+        link = self.ss.links.get(peer.id)
+        if link is None and any(p.id == peer.id for p in self.ss.peers):
+            link = self.ss.links[peer.id] = AsyncPeerLink(peer.host_port_tup, self.ss.wire_protocol)
+        return link
+
+
+async def serve_many(servers, on_ready=None):
+    """Serve many AsyncGossipServers on the running event loop, until every one of them is closed."""
+    for server in servers:
+        server._start_background_tasks()
+    await asyncio.gather(*(server.listen() for server in servers))
+    if on_ready is not None:
+        on_ready()
+    await asyncio.gather(*(server.wait_closed() for server in servers))
+
+
+class AsyncGossipConnection(GossipCommandProcessor):
+    """Processes the commands arriving on one inbound connection to an AsyncGossipServer."""
+
+    def __init__(self, server, writer):
+        self.server = server
+        self.ss = server.ss
+        self.writer = writer
+        self.pending_relays = []
+        self.pending_pulls = []
+        self.pending_stream = None
+
+    def _write_response(self, data):
+        self.ss.metrics.bytes_out += len(data)
+        self.writer.write(data)
+
+    def _send_relays(self, relays):
+        self.pending_relays += relays
+
+    def _pull_bodies(self, pulls, relays):
+        self.pending_pulls.append((pulls, relays))
+
+    def _stream_response(self, chunks):
+        self.pending_stream = chunks
+
+    def _stop_server(self):
+        self.server.close()
+
+    async def flush(self):
+        await self.writer.drain()
+        chunks, self.pending_stream = self.pending_stream, None
+        if chunks is not None:
+            for chunk in chunks:    # drained as it goes, so a slow reader holds back the stream rather than buffering it
+                self._write_response(chunk)
+                await self.writer.drain()
+        pulls_ls, self.pending_pulls = self.pending_pulls, []
+        for pulls, relays in pulls_ls:  # off the event loop, and before the relays waiting on them go out below
+            await asyncio.to_thread(self._fetch_bodies, pulls)
+            self._send_pulled_relays(relays)
+        relays, self.pending_relays = self.pending_relays, []
+        if relays:
+            started_ns = time.perf_counter_ns()
+            batches = list(self._batch_by_peer(relays))
+            results = await asyncio.gather(*(self._relay(p, batch) for p, batch in batches),
+                return_exceptions=True)     # a failed peer must not cancel the relays to the others
+            self.server.relay_failures += sum(len(batch) for (_, batch), res in zip(batches, results) if res is not None)
+            self.ss.metrics.fanout.observe_since(started_ns)
+
+    def _get_transport_stats(self):
+        return {
+            "relay_bytes_out": sum(link.bytes_sent for link in list(self.ss.links.values())),
+            "relay_failures":  self.server.relay_failures,
+            "relays_dropped":  0,   # relays are never queued, so never dropped: the inbound connection waits instead
+            "outbound_depth":  0,
+        }
+
+    def _batch_by_peer(self, relays):
+        peers, peer_relays = {}, defaultdict(list)
+        for p, relay in relays:
+            peers[p.id] = p
+            peer_relays[p.id].append(relay)
+        bs = self.ss.relay_batch_size
+        for peer_id, prs in peer_relays.items():
+            for i in range(0, len(prs), bs):
+                yield peers[peer_id], prs[i:i + bs]
+
+    async def _relay(self, peer, batch):
+        async with self.server._relay_slots:
+            if (link := self.server.get_link(peer)) is None:
+                return
+            await asyncio.wait_for(link.send(partial(wire.encode_relays, batch)), timeout=OUTBOUND_SEND_TIMEOUT)
+
+
+class AsyncPeerLink:
+    """A persistent asyncio stream to a single peer, reconnected on failure.
+
+    Like PeerConnectionPool, it negotiates the binary protocol on connect when wire="binary".
+    """
+
+    def __init__(self, host_port_tup, wire="binary"):
+        self.host_port_tup = host_port_tup
+        self.wire = wire
+        self.proto = "text"
+        self.bytes_sent = 0
+        self._reader = self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def send(self, encode):
+        async with self._lock:  # keeps frames from concurrent relays from interleaving on the stream
+            for attempt in range(2):
+                try:
+                    if self._is_stale():
+                        await self._connect()
+                    data = encode(self.proto)
+                    self._writer.write(data)
+                    await self._writer.drain()
+                    self.bytes_sent += len(data)
+                    return
+                except OSError:
+                    self._close()
+                    if attempt:
+                        raise
+
+    async def _connect(self):
+        self._close()
+        try:
+            await self._open()
+            self.proto = "text"
+            if self.wire == "binary":
+                self._writer.write(wire.PROTO_BINARY_REQUEST)
+                ack = await asyncio.wait_for(self._reader.readline(), timeout=POOL_CONNECT_TIMEOUT)
+                if ack == wire.PROTO_BINARY_ACK:
+                    self.proto = "binary"
+                else:   # peers that only speak text drop the connection on the unknown /PROTO command
+                    self._close()
+                    await self._open()
+        except BaseException:
+            # e.g. the send timing out mid-handshake: a half-negotiated stream, whose peer may have switched to binary
+            # already, must not be written text frames to, so it's dropped, to be reconnected on the next send
+            self._close()
+            raise
+
+    async def _open(self):
+        self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(*self.host_port_tup),
+            timeout=POOL_CONNECT_TIMEOUT)
+
+    def _is_stale(self):
+        # peers never write back on relay connections, so EOF on the reader means the peer has gone away
+        return self._writer is None or self._writer.is_closing() or self._reader.at_eof()
+
+    def _close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
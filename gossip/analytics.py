@@ -0,0 +1,101 @@
+"""Convergence analytics of a GossipNetwork, computed with sparse matrix operations over its graph.
+
+Rather than walking the graph node by node, every hop of a flood is one sparse matrix product, taken from a whole
+block of origins at once. Requires numpy & scipy (`poetry install -E analytics`).
+"""
+
+import random
+import numpy as np
+import networkx as nx
+from scipy import sparse
+
+
+ORIGINS_BLOCK_SIZE = 64     # origins analyzed together, as the columns of a single dense matrix
+
+
+def adjacency(network):
+    """The network's adjacency matrix in CSR format; row & column i belong to the i-th smallest node ID."""
+    return nx.to_scipy_sparse_array(network.G, nodelist=sorted(network.G.nodes), dtype=np.float32, format="csr")
+
+
+def infection_curves(A, origin_idxs):
+    """The cumulative number of nodes reached by each hop of a flood, from each origin.
+
+    Returns a (hops + 1) × origins array, whose row h counts the nodes within h hops of each origin; origins whose
+    flood settles early simply repeat their final count in the later rows.
+    """
+    num_origins = len(origin_idxs)
+    reached = np.zeros((A.shape[0], num_origins), dtype=bool)
+    reached[origin_idxs, np.arange(num_origins)] = True
+    frontier, counts = reached, [reached.sum(axis=0)]
+    while True:
+        frontier = (A @ frontier.astype(np.float32) > 0) & ~reached
+        if not frontier.any():
+            return np.array(counts)
+        reached |= frontier
+        counts.append(reached.sum(axis=0))
+
+
+def eccentricities(curves):
+    """The hops each origin's flood takes to reach every node it can, from its infection curve."""
+    return (curves < curves[-1]).sum(axis=0)
+
+
+def expected_relays(A, origin_idxs, relay_limit=1):
+    """The total relays a flooded message takes to settle, from each origin.
+
+    A server relays a message to each of its peers (but the one it got it from) every time it receives it, until
+    it has relayed it relay_limit times to that peer. So the relays S along each directed edge v→p settle at the
+    least fixed point of:  S[v→p] = min(relay_limit, sum of S[q→v] over all peers q ≠ p, + 1 if v is the origin)
+    """
+    coo = A.tocoo()
+    order = np.argsort(coo.row.astype(np.int64) * A.shape[0] + coo.col)
+    src, dst = coo.row[order], coo.col[order]
+    edge_keys = src.astype(np.int64) * A.shape[0] + dst
+    rev = np.searchsorted(edge_keys, dst.astype(np.int64) * A.shape[0] + src)  # index of each edge's reverse
+    into = sparse.csr_array((np.ones(len(src), dtype=np.float32), (dst, np.arange(len(src)))),
+                            shape=(A.shape[0], len(src)))   # sums the relays arriving at each node
+
+    from_origin = (src[:, None] == np.asarray(origin_idxs)[None, :]).astype(np.float32)
+    S = np.zeros_like(from_origin)
+    while True:
+        S_next = np.minimum(relay_limit, (into @ S)[src] - S[rev] + from_origin)
+        if np.array_equal(S_next, S):
+            return S.sum(axis=0)
+        S = S_next
+
+
+def analyze(network, relay_limit=1, num_origins=None, seed=None):
+    """Predict how a flooded message converges over the network, from num_origins random origins (default: all)."""
+    A = adjacency(network)
+    num_nodes = A.shape[0]
+    degrees = np.diff(A.indptr)
+    origin_idxs = np.arange(num_nodes)
+    if num_origins is not None and num_origins < num_nodes:
+        origin_idxs = np.array(sorted(random.Random(seed).sample(range(num_nodes), num_origins)))
+
+    curves, eccs, relays = [], [], []
+    for i in range(0, len(origin_idxs), ORIGINS_BLOCK_SIZE):
+        block = origin_idxs[i:i + ORIGINS_BLOCK_SIZE]
+        block_curves = infection_curves(A, block)
+        curves.append(block_curves)
+        eccs.append(eccentricities(block_curves))
+        relays.append(expected_relays(A, block, relay_limit))
+    max_hops = max(len(c) for c in curves)
+    curves = np.hstack([np.pad(c, ((0, max_hops - len(c)), (0, 0)), mode="edge") for c in curves])
+    eccs, relays = np.concatenate(eccs), np.concatenate(relays)
+    # any node's eccentricity bounds the diameter from below, and its double from above; exact once all are origins
+    diameter_upper = eccs.max() if len(eccs) == num_nodes else min(2 * eccs.min(), num_nodes - 1)
+
+    return {
+        "nodes":           num_nodes,
+        "edges":           int(degrees.sum()) // 2,
+        "degree":          (int(degrees.min()), float(degrees.mean()), int(degrees.max())),
+        "origins":         len(origin_idxs),
+        "is_connected":    bool((curves[-1] == num_nodes).all()),
+        "infection_curve": (curves.mean(axis=1) / num_nodes).tolist(),   # mean fraction of nodes reached per hop
+        "eccentricity":    (int(eccs.min()), float(eccs.mean()), int(eccs.max())),
+        "diameter_bounds": (int(eccs.max()), int(diameter_upper)),
+        "relays_per_msg":  float(relays.mean()),
+        "relays_per_node": float(relays.mean()) / num_nodes,
+    }
@@ -0,0 +1,95 @@
+import base64, random, threading
+
+from gossip.client import GossipClient
+from gossip.digest import BloomFilter
+from gossip.msg_store import MessageRecord
+from gossip.constants import ANTI_ENTROPY_FP_RATE
+
+
+def build_digest(ss):
+    """A Bloom filter of the IDs of every message held in full (i.e. with its body) by the server, and of those it
+    evicted: the peer would send them over for nothing, as they'd only be dropped again."""
+    held_msgs = [msg_id for msg_id, msg_attrs in list(ss.msgs_box.items()) if msg_attrs.content is not None]
+    held_msgs += ss.msgs_box.get_evicted_ids()
+    digest = BloomFilter.for_capacity(len(held_msgs), ANTI_ENTROPY_FP_RATE, random.getrandbits(64))
+    for msg_id in held_msgs:
+        digest.add(msg_id)
+    return digest
+
+
+def collect_missing(ss, digest):
+    """The messages held by the server that aren't in the peer's digest, as (msg_id, content, origin_ts, path) lists."""
+    return [[msg_id, msg_attrs.content, msg_attrs.origin_ts, msg_attrs.in_paths.get_shortest()[0]]
+        for msg_id, msg_attrs in list(ss.msgs_box.items())
+        if msg_attrs.content is not None and msg_id not in digest]
+
+
+def ingest_missing(ss, msgs):
+    """Store the messages pulled from (or pushed by) a peer; returns how many were new to the server.
+
+    Repaired messages aren't relayed any further: spreading them is left to the following anti-entropy rounds.
+    """
+    num_new = 0
+    for msg_id, content, origin_ts, node_path in msgs:
+        if ss.msgs_box.is_evicted(msg_id):
+            continue
+        with ss.msgs_box.lock_for(msg_id):
+            msg_attrs, is_new = ss.msgs_box.get_or_create(msg_id, lambda: MessageRecord(len(ss.peer_slots)))
+            if msg_attrs.content is not None:
+                continue
+            num_new += is_new
+            msg_attrs.set_body(content, origin_ts)
+            msg_attrs.add_path(node_path + [ss.node_id])
+            ss.msgs_box.touch(msg_id)
+    return num_new
+
+
+def encode_digest(digest):
+    return base64.b64encode(digest.to_bytes()).decode()
+
+
+def decode_digest(digest_str):
+    return BloomFilter.from_bytes(base64.b64decode(digest_str))
+
+
+class AntiEntropy:
+    """Periodically reconciles the server's messages with those of a random peer, by push-pull digest exchange.
+
+    The server sends its digest to the peer, which answers with the messages missing from it along with the peer's
+    own digest; the server then pushes back the messages the peer is missing.
+    """
+
+    def __init__(self, ss, interval):
+        self.ss = ss
+        self.interval = interval
+        self.rounds = self.pulled = self.pushed = self.failed = 0
+        self._stopped = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name="anti-entropy", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def get_stats(self):
+        return {"rounds": self.rounds, "pulled": self.pulled, "pushed": self.pushed, "failed": self.failed}
+
+    def _run(self):
+        # jittered, so that the nodes of a network started together don't all sync at the same instants
+        while not self._stopped.wait(self.interval * random.uniform(0.5, 1.5)):
+            if not self.ss.peers:
+                continue
+            try:
+                self.sync_with(random.choice(self.ss.peers))
+            except (OSError, ValueError):   # ValueError: the peer closed the connection without a full answer
+                self.failed += 1
+
+    def sync_with(self, peer):
+        client = GossipClient(peer.address)
+        peer_digest_str, missing_msgs = client.sync_digests(encode_digest(build_digest(self.ss)))
+        self.pulled += ingest_missing(self.ss, missing_msgs)
+        peer_missing_msgs = collect_missing(self.ss, decode_digest(peer_digest_str))
+        if peer_missing_msgs:
+            client.push_msgs(peer_missing_msgs)
+            self.pushed += len(peer_missing_msgs)
+        self.rounds += 1
@@ -0,0 +1,130 @@
+"""Benchmark how fast messages propagate through a real network of server processes, and at what cost.
+
+The network is started just for the benchmark, with each node in its own process as in start_network; messages are
+sent to random nodes at a target rate, and every node reports back when it first heard of each of them.
+"""
+
+import os, sys, time, random
+import multiprocessing as mp
+from dataclasses import asdict
+from importlib import metadata
+
+from gossip.client import GossipClient
+from gossip.start_network import build_network, start_server, gn_addr
+from gossip.simulate import percentile
+
+
+def run_benchmark(network_type, num_nodes, extra_graph_params=None, engine="threading", settings_opts=None,
+                  num_msgs=100, rate=10.0, relay_limit=1, dissemination=None, seed=None, timeout=30.0):
+    """Start a network, send num_msgs messages into it at `rate` per second, and report on their propagation."""
+    network = build_network(network_type, num_nodes, extra_graph_params, seed)
+    procs = {node_id: mp.Process(target=_start_quiet_server, args=(network, node_id, engine, settings_opts), daemon=True)
+        for node_id in network.G.nodes}
+    for proc in procs.values():
+        proc.start()
+
+    try:
+        clients = {node_id: GossipClient(gn_addr(node_id)) for node_id in procs}
+        _wait_until_ready(clients.values(), timeout)
+        rusage_before = {node_id: c.get_rusage() for node_id, c in clients.items()}
+        send_started_ns, send_ended_ns = _send_msgs(list(clients.values()), num_msgs, rate, relay_limit, dissemination,
+                                                    random.Random(seed))
+        reception_times = _wait_for_convergence(clients, num_msgs, timeout)
+        rusage_after = {node_id: c.get_rusage() for node_id, c in clients.items()}
+    finally:
+        for proc in procs.values():
+            proc.terminate()
+        for proc in procs.values():
+            proc.join()
+
+    report = {
+        "version": _get_version(),
+        "params": {
+            "network_type": network_type, "num_nodes": num_nodes, "engine": engine, "num_msgs": num_msgs,
+            "rate": rate, "relay_limit": relay_limit, "seed": seed,
+            "dissemination": asdict(dissemination) if dissemination is not None else None,
+        },
+        "send_rate": num_msgs / max((send_ended_ns - send_started_ns) / 1e9, 1e-9),
+    }
+    report.update(_summarize_receptions(reception_times, num_nodes, num_msgs))
+    report["nodes"] = _summarize_rusage(rusage_before, rusage_after)
+    return report
+
+
+def _start_quiet_server(network, node_id, engine, settings_opts):
+    sys.stdout = open(os.devnull, "w")  # keep the servers' banners out of the benchmark's report
+    start_server(network, node_id, engine, settings_opts)
+
+
+def _wait_until_ready(clients, timeout):
+    deadline = time.monotonic() + timeout
+    for c in clients:
+        while True:
+            try:
+                c.get_peers_info(get_ids=True)
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"{c} didn't start within {timeout}s")
+                time.sleep(0.05)
+
+
+def _send_msgs(clients, num_msgs, rate, relay_limit, dissemination, rng):
+    started = time.perf_counter()
+    started_ns = time.time_ns()
+    for i in range(num_msgs):
+        delay = started + i / rate - time.perf_counter()    # paced against the start, so that delays don't add up
+        if delay > 0:
+            time.sleep(delay)
+        rng.choice(clients).send_message(f"bench-msg-{i}", relay_limit=relay_limit, dissemination=dissemination)
+    return started_ns, time.time_ns()
+
+
+def _wait_for_convergence(clients, num_msgs, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        reception_times = {node_id: c.get_reception_times() for node_id, c in clients.items()}
+        if all(len(rts) >= num_msgs for rts in reception_times.values()) or time.monotonic() > deadline:
+            return reception_times
+        time.sleep(0.2)
+
+
+def _summarize_receptions(reception_times, num_nodes, num_msgs):
+    msgs = {}   # msg ID -> [origin_ts, nodes reached, last received_ns, total relays sent]
+    for rts in reception_times.values():
+        for msg_id, (origin_ts, received_ns, relays_sent) in rts.items():
+            msg = msgs.setdefault(msg_id, [origin_ts, 0, 0, 0])
+            msg[1] += 1
+            msg[2] = max(msg[2], received_ns)
+            msg[3] += relays_sent
+
+    converged = [msg for msg in msgs.values() if msg[1] == num_nodes]
+    convergence_ms = sorted((last_ns - origin_ts) / 1e6 for origin_ts, _, last_ns, _ in converged)
+    if converged:
+        first_sent_ns = min(msg[0] for msg in msgs.values())
+        all_converged_ns = max(msg[2] for msg in converged)
+        throughput = len(converged) / max((all_converged_ns - first_sent_ns) / 1e9, 1e-9)
+    else:
+        throughput = 0.0
+    return {
+        "msgs_sent":        num_msgs,
+        "msgs_converged":   len(converged),
+        "coverage":         sum(msg[1] for msg in msgs.values()) / (num_nodes * num_msgs) if num_msgs else 0.0,
+        "convergence_ms":   {f"p{pct}": percentile(convergence_ms, pct) for pct in (50, 95, 99)},
+        "throughput":       throughput,     # messages fully converged per second, from the first one sent
+        "relays_per_msg":   sum(msg[3] for msg in msgs.values()) / len(msgs) if msgs else 0.0,
+    }
+
+
+def _summarize_rusage(rusage_before, rusage_after):
+    return {node_id: {
+            "cpu_secs":   (ru["cpu_user"] + ru["cpu_sys"]) - (rusage_before[node_id]["cpu_user"] + rusage_before[node_id]["cpu_sys"]),
+            "max_rss_kb": ru["max_rss_kb"],
+        } for node_id, ru in rusage_after.items()}
+
+
+def _get_version():
+    try:
+        return metadata.version("gossip")
+    except metadata.PackageNotFoundError:   # run from a source checkout
+        return None
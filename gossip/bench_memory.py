@@ -0,0 +1,75 @@
+"""Measure the per-message memory footprint of a server's msgs_box; run with `python -m gossip.bench_memory`.
+
+Usage:
+  bench_memory [-m <msgs>] [-k <peers>] [-p <paths>] [-l <hops>]
+
+Options:
+  -m <msgs>    Number of messages to store [default: 10000]
+  -k <peers>   Number of peers the server has [default: 3]
+  -p <paths>   Number of paths stored per message [default: 3]
+  -l <hops>    Number of hops in each path [default: 5]
+"""
+
+import random, tracemalloc
+from collections import Counter
+from docopt import docopt
+
+from gossip.msg_store import MessageRecord
+
+
+def legacy_msg_attrs(peer_ids, paths):
+    # the dict-of-Counters layout msgs_box used before MessageRecord
+    return {
+        "in_paths":   [list(p) for p in paths],
+        "in_counts":  Counter({pid: 0 for pid in peer_ids}),
+        "out_counts": Counter({pid: 0 for pid in peer_ids}),
+        "is_unread":  True,
+        "content":    None,
+        "origin_ts":  None,
+    }
+
+
+def compact_msg_record(peer_ids, paths):
+    record = MessageRecord(len(peer_ids))
+    for p in paths:
+        record.add_path(p)
+    return record
+
+
+def measure_bytes_per_msg(new_msg, num_msgs, peer_ids, paths):
+    msg_ids = [f"{i:032x}" for i in range(num_msgs)]   # allocated up front, as they're the same for both layouts
+    tracemalloc.start()
+    msgs_box = {msg_id: new_msg(peer_ids, paths) for msg_id in msg_ids}
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del msgs_box
+    return allocated / num_msgs
+
+
+def gen_paths(num_paths, num_hops, seed=0):
+    # like the paths relayed to a node, each one branches off from one of the others after at least the origin hop
+    rng = random.Random(seed)
+    paths = [list(range(num_hops))]
+    while len(paths) < num_paths:
+        base = rng.choice(paths)
+        fork = rng.randrange(1, num_hops)
+        paths.append(base[:fork] + [rng.randrange(1000) for _ in range(num_hops - fork)])
+    return paths
+
+
+def main():
+    args = docopt(__doc__)
+    num_msgs, num_peers = int(args["-m"]), int(args["-k"])
+    num_paths, num_hops = int(args["-p"]), int(args["-l"])
+    peer_ids = list(range(1, num_peers + 1))
+    paths = gen_paths(num_paths, num_hops)
+
+    legacy = measure_bytes_per_msg(legacy_msg_attrs, num_msgs, peer_ids, paths)
+    compact = measure_bytes_per_msg(compact_msg_record, num_msgs, peer_ids, paths)
+    print(f"{num_msgs} messages, {num_peers} peers, {num_paths} paths of {num_hops} hops each:")
+    print(f"* dict of Counters: {legacy:.0f} bytes/message")
+    print(f"* MessageRecord:    {compact:.0f} bytes/message ({compact / legacy:.0%})")
+
+
+if __name__ == "__main__":
+    main()
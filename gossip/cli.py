@@ -1,32 +1,82 @@
 """Gossip.
 
 Usage:
-  gossip start-network [circular | powerlaw | random [<degree>]] [-n <nn>] [-P]
+  gossip start-network [circular | powerlaw | random [<degree>]] [-n <nn>] [-e <eng> | -W <n>] [-b <bs>] [-d <ms>] [-w <wire>]
+                       [--max-msgs <n>] [--max-bytes <n>] [--ttl <secs>] [--anti-entropy <secs>]
+                       [-s <strategy>] [-k <k>] [--max-hops <h>] [--data-dir <dir>] [--membership <secs>] [-P]
   gossip stop-network
-  gossip send-message <node-number> <message> [-r <count>]
-  gossip get-messages <node-number> [unread | read | all] [[-p] [-pp] | [-A]] [-t...]
+  gossip send-message <node-number> <message> [-r <count>] [-s <strategy>] [-k <k>] [--max-hops <h>]
+  gossip get-messages <node-number> [unread | read | all] [[-p] [-pp] | [-A]] [-t...] [--since <secs>] [--limit <n>]
   gossip remove-node <node-number>
-  gossip list-peers <node-number>
+  gossip restart-node <node-number> [-e <eng>] [--data-dir <dir>] [--max-msgs <n>] [--max-bytes <n>] [--ttl <secs>]
+  gossip reconnect-node <node-number> <peer-number>...
+  gossip list-peers [<node-numbers>...]
+  gossip queue-stats <node-number>
+  gossip store-stats <node-number>
+  gossip node-stats [<node-number>]
+  gossip simulate [circular | powerlaw | random [<degree>]] [-n <nn>] [-m <msgs>] [-r <count>] [--seed <s>]
+                  [--latency <ms>] [--jitter <ms>] [--loss <p>] [-s <strategy>] [-k <k>] [--max-hops <h>]
+                  [--churn <p> [--no-repair]]
+  gossip analyze [circular | powerlaw | random [<degree>]] [-n <nn>] [-r <count>] [--seed <s>] [--origins <o>]
+  gossip benchmark [circular | powerlaw | random [<degree>]] [-n <nn>] [-e <eng>] [-m <msgs>] [--rate <r>] [-r <count>]
+                   [--seed <s>] [--timeout <secs>] [-o <file>] [-s <strategy>] [-k <k>] [--max-hops <h>]
 
 --Options:
   <degree>                      The degree of connectedness for each node in a random regular graph [default: 3]
   -n <nn>, --num-nodes <nn>     Number of nodes to initialize the Gossip Network with [default: 16]
+  -e <eng>, --engine <eng>      Server engine to run each node on: threading | asyncio [default: threading]
+  -W <n>, --workers <n>         Pack the nodes into n worker processes (0 for one per CPU core), each running its nodes
+                                on a single asyncio event loop, rather than starting a process per node
+  -b <bs>, --batch-size <bs>    Max number of relays batched into a single frame to a peer [default: 1]
+  -d <ms>, --batch-delay <ms>   Max milliseconds a relay waits for its batch to fill up [default: 0]
+  -w <wire>, --wire <wire>      Protocol relays are sent to peers with: binary | text [default: binary]
+  --max-msgs <n>                Max number of messages each node stores, evicting the least recently updated ones
+  --max-bytes <n>               Max (estimated) bytes of messages each node stores
+  --ttl <secs>                  Seconds after its last update that a stored message expires
+  --anti-entropy <secs>         Seconds between each node's digest exchanges with a random peer, to repair lost messages
+  --data-dir <dir>              Directory where each node logs its messages, to recover them when restarted
+  --membership <secs>           Seconds between each node's heartbeats to its peers, to replace the failed ones with
+                                new peers placed like the network's graph generator would
   -P, --plot                    Plot the network graph on start-network (requires matplotlib)
 
   -r <limit>, --relays <limit>  Number of times each server node relays the sent message to its peers [default: 1]
+  -s <strategy>, --strategy <strategy>
+                                How messages are spread: flood | fanout | lazy (the network's default on send-message)
+  -k <k>, --fanout <k>          Relay each message to only k peers picked at random on every hop
+  --max-hops <h>                Stop relaying a message once it has travelled h hops
+
+  -m <msgs>, --msgs <msgs>      Number of messages sent to random nodes on simulate & benchmark [default: 1]
+  --seed <s>                    Seed of all of a simulation's (or benchmark's) randomness, topology included [default: 0]
+  --latency <ms>                Milliseconds each simulated frame takes to reach its peer [default: 10]
+  --jitter <ms>                 Max random milliseconds added to each simulated frame's latency [default: 0]
+  --loss <p>                    Probability of each simulated frame being lost [default: 0]
+  --churn <p>                   Fraction of the simulated nodes failed at once, after the messages are sent; as many
+                                are sent again once the survivors have repaired the topology
+  --no-repair                   Send them again right after the failures, with no repair
+  --origins <o>                 Number of random origins to analyze floods from (all nodes if unset)
+  --rate <r>                    Messages sent per second on benchmark [default: 10]
+  --timeout <secs>              Max seconds a benchmark waits for the network to start, then to converge [default: 60]
+  -o <file>, --output <file>    Write the benchmark's JSON report to a file, rather than to stdout
 
   -p                            Display the SHORTEST path(s) taken by message to reach node (can be combined w/ -pp)
   -pp                           Display the LONGEST path(s) taken by message to reach node (can be combined w/ -p)
   -A, --all-paths               Display ALL paths taken by message to reach node
   -t, --time                    Display the times when each message was received by the network (repeat for more time info)
+  --since <secs>                Only get the messages sent within the last <secs> seconds
+  --limit <n>                   Get at most <n> messages, oldest first
 """
 
-import subprocess, time
+import os, signal, time, json
 from docopt import docopt
 
 import gossip.server_pids as sp
-from gossip.start_network import start_network
+from gossip.start_network import start_network, start_node, build_network
+from gossip.simulate import simulate, simulate_churn
+from gossip.bench import run_benchmark
 from gossip.client import GossipClient
+from gossip.admin import AdminClient
+from gossip.dissemination import Dissemination, DEFAULT_DISSEMINATION
+from gossip.metrics import merge_stats, hist_percentile
 from gossip.constants import *
 
 
@@ -45,6 +95,10 @@ def get_network_type(docopt_args_dict):
     else:
         return "random"
 
+def get_extra_graph_params(docopt_args_dict, network_type):
+    random_k_deg = int(docopt_args_dict["<degree>"]) if docopt_args_dict["<degree>"] else 3
+    return {"random_k_deg": random_k_deg if network_type == "random" else None}
+
 def get_msgs_status_type(docopt_args_dict):
     if docopt_args_dict["unread"]:
         return "unread"
@@ -63,6 +117,72 @@ def get_msgs_paths_type(docopt_args_dict):
     else:
         return "all"
 
+def get_dissemination(docopt_args_dict):
+    strategy, fanout, max_hops = docopt_args_dict["--strategy"], docopt_args_dict["--fanout"], docopt_args_dict["--max-hops"]
+    if strategy is None and fanout is None and max_hops is None:
+        return None
+    if strategy is None:
+        strategy = "fanout" if fanout else "flood"
+    return Dissemination(strategy, int(fanout or 0), int(max_hops or 0))
+
+def get_store_bounds(docopt_args_dict):
+    max_msgs, max_bytes, ttl = docopt_args_dict["--max-msgs"], docopt_args_dict["--max-bytes"], docopt_args_dict["--ttl"]
+    return {
+        "store_max_entries": int(max_msgs) if max_msgs else None,
+        "store_max_bytes":   int(max_bytes) if max_bytes else None,
+        "store_ttl":         float(ttl) if ttl else None,
+    }
+
+def get_seed_node_ids():
+    # the nodes the network was started with; any others are found through their peers
+    try:
+        return [int(n) for n in sp.get_node_ids(sp.read_server_pids_to_map())] or [1]
+    except FileNotFoundError:
+        return [1]
+
+def get_launched_pids():
+    try:
+        return sp.get_pids(sp.read_server_pids_to_map())
+    except FileNotFoundError:
+        return []
+
+def stop_processes(pids, timeout=ADMIN_TIMEOUT):
+    """Wait for the processes to exit, then kill those still running; returns the pids killed."""
+    deadline = time.monotonic() + timeout
+    while (running := [pid for pid in pids if sp.is_running(pid)]) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    for pid in running:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    return running
+
+def stop_plot():
+    try:
+        plot_pid = sp.read_server_pids_to_map().get("plot")
+        if plot_pid is not None:
+            os.kill(plot_pid, signal.SIGTERM)
+    except (FileNotFoundError, ProcessLookupError):
+        pass
+
+def wait_until_stopped(client, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            client.get_peers_info(get_ids=True)
+        except OSError:
+            return
+        time.sleep(0.05)
+    raise TimeoutError(f"{client} didn't stop within {timeout}s")
+
+def format_latency(hist):
+    if not hist["count"]:
+        return "-"
+    mean_us = hist["total_ns"] / hist["count"] / 1000
+    p50_us, p99_us = hist_percentile(hist, 50) / 1000, hist_percentile(hist, 99) / 1000
+    return f"n={hist['count']} mean={mean_us:.1f}µs p50<{p50_us:.0f}µs p99<{p99_us:.0f}µs"
+
 def format_msg_w_time(docopt_args_dict, msg_ts_tup):
     msg, ts_ns = msg_ts_tup
     # TODO: refactor this using structural pattern matching
@@ -89,59 +209,204 @@ def main():
     if args["start-network"]:
         num_nodes = int(args["--num-nodes"])
         network_type = get_network_type(args)
-        random_k_deg = int(args["<degree>"]) if args["<degree>"] else 3
-        extra_graph_params = {"random_k_deg": random_k_deg if network_type == "random" else None}
-        start_network(network_type, num_nodes, extra_graph_params, args["--plot"])
+        extra_graph_params = get_extra_graph_params(args, network_type)
+        settings_opts = {
+            "relay_batch_size":  int(args["--batch-size"]),
+            "relay_batch_delay": float(args["--batch-delay"]) / 1000,
+            "wire_protocol":     args["--wire"],
+            **get_store_bounds(args),
+            "anti_entropy_interval": float(args["--anti-entropy"]) if args["--anti-entropy"] else None,
+            "dissemination":     get_dissemination(args) or DEFAULT_DISSEMINATION,
+            "data_dir":          args["--data-dir"],
+            "membership_interval":  float(args["--membership"]) if args["--membership"] else None,
+            "membership_placement": network_type,
+        }
+        num_workers = int(args["--workers"]) if args["--workers"] is not None else None
+        start_network(network_type, num_nodes, extra_graph_params, args["--plot"], args["--engine"], settings_opts,
+                      num_workers)
 
     elif args["stop-network"]:
-        pids_ls_str = " ".join(str(pid) for pid in sp.read_server_pids_to_map().values())
-        comp_proc = subprocess.run(f"echo {pids_ls_str} | xargs -n1 kill", shell=True)
-        if comp_proc.returncode == 0:
-            print("Gossip network stopped")
-            sp.write_pids_map_to_file({})
-        else:
-            print("Gossip network stopping failed")
+        started = time.perf_counter()
+        admin = AdminClient()
+        node_infos = admin.discover(get_seed_node_ids())
+        stopped = admin.stop(node_infos)
+        # nodes that are hung, or didn't get the /SHUTDOWN, are killed: those the network was started with are still
+        # found in the pids file even when they don't answer at all
+        pids = {info["pid"] for info in node_infos.values()} | set(get_launched_pids())
+        killed = stop_processes(pids - {os.getpid()})
+        stop_plot()
+        sp.write_pids_map_to_file({})
+        print(f"Gossip network of {len(stopped)} nodes stopped in {(time.perf_counter() - started) * 1000:.0f}ms")
+        if killed:
+            print(f"Killed {len(killed)} processes that didn't exit: {', '.join(str(pid) for pid in sorted(killed))}")
 
     elif args["send-message"]:
         message = args["<message>"]
         client = init_gossip_client(args["<node-number>"])
-        client.send_message(message, relay_limit=int(args["--relays"]))
+        client.send_message(message, relay_limit=int(args["--relays"]), dissemination=get_dissemination(args))
         print(f"Message sent to {client}")
 
     elif args["get-messages"]:
         client = init_gossip_client(args["<node-number>"])
         msgs_status_type, msgs_paths_type = get_msgs_status_type(args), get_msgs_paths_type(args)
-        msgs_data = client.get_messages(msgs_status_type, msgs_paths_type)
-        print(f"Fetched {msgs_status_type} messages from {client}; showing {msgs_paths_type} path(s):")
-        for msg_ts_tup, msg_paths in msgs_data.items():
+        since = time.time_ns() - int(float(args["--since"]) * 1e9) if args["--since"] else 0
+        limit = int(args["--limit"]) if args["--limit"] else None
+        msgs_data = client.get_messages(msgs_status_type, msgs_paths_type, since, limit)
+        print(f"Fetching {msgs_status_type} messages from {client}; showing {msgs_paths_type} path(s):")
+        for msg_ts_tup, msg_paths in msgs_data:
             print()
             print(f"• {format_msg_w_time(args, msg_ts_tup)}")
             for mp in msg_paths:
                 print(f"  ↳ {mp}")
 
     elif args["remove-node"]:
-        node_number = args["<node-number>"]
-        client = init_gossip_client(node_number)
-        peer_ids = client.get_peers_info(get_ids=True)
-
-        pids_map = sp.read_server_pids_to_map()
-        node_pid = pids_map.pop(node_number)
-        comp_proc = subprocess.run([f"kill {node_pid}"], shell=True)
-
-        if comp_proc.returncode == 0:
-            for p in peer_ids:
-                init_gossip_client(p).remove_peer(node_number)
+        client = init_gossip_client(args["<node-number>"])
+        if AdminClient().remove([client.id]):
             print(f"{client} removed")
-            sp.write_pids_map_to_file(pids_map)
         else:
             print(f"Failed to remove {client}")
 
+    elif args["restart-node"]:
+        client = init_gossip_client(args["<node-number>"])
+        peer_ids = [peer_id for peer_id, _ in client.get_node_info()["peers"]]
+        client.shutdown()
+        wait_until_stopped(client)
+        # the node now runs in this process, in the foreground like start-network; stop-network still finds it
+        start_node(client.id, peer_ids, args["--engine"], {"data_dir": args["--data-dir"], **get_store_bounds(args)})
+
+    elif args["reconnect-node"]:
+        client = init_gossip_client(args["<node-number>"])
+        peer_ids = [int(n) for n in args["<peer-number>"]]
+        AdminClient().reconnect(client.id, peer_ids)
+        print(f"{client} connected to {', '.join(f'Gossip-Node-{p}' for p in peer_ids)}")
+
     elif args["list-peers"]:
+        if len(args["<node-numbers>"]) == 1:
+            client = init_gossip_client(args["<node-numbers>"][0])
+            peer_names = client.get_peers_info(get_names=True)
+            print(f"{client} has peers:")
+            for pn in peer_names:
+                print(f"* {pn}")
+        else:
+            admin = AdminClient()
+            node_ids = [int(n) for n in args["<node-numbers>"]] or list(admin.discover(get_seed_node_ids()))
+            for node_id, peers in sorted(admin.list_peers(node_ids).items()):
+                print(f"Gossip-Node-{node_id}: {', '.join(str(peer_id) for peer_id, _ in peers) or '-'}")
+
+    elif args["queue-stats"]:
         client = init_gossip_client(args["<node-number>"])
-        peer_names = client.get_peers_info(get_names=True)
-        print(f"{client} has peers:")
-        for pn in peer_names:
-            print(f"* {pn}")
+        queues_stats = client.get_queues_stats()
+        print(f"{client} outbound relay queues:")
+        for peer_id, qs in queues_stats.items():
+            print(f"* Gossip-Node-{peer_id}: depth={qs['depth']} enqueued={qs['enqueued']} sent={qs['sent']} "
+                  f"dropped={qs['dropped']} coalesced={qs['coalesced']} failed={qs['failed']} frames={qs['frames']}")
+
+    elif args["store-stats"]:
+        client = init_gossip_client(args["<node-number>"])
+        ss = client.get_store_stats()
+        print(f"{client} message store:")
+        print(f"* {ss['entries']} messages" + (f", ~{ss['bytes']} bytes" if "bytes" in ss else ""))
+        print(f"* {ss['evictions']} evicted, {ss['expirations']} expired, {ss['tombstones']} tombstones kept")
+        if "anti_entropy" in ss:
+            ae = ss["anti_entropy"]
+            print(f"* anti-entropy: {ae['rounds']} rounds, {ae['pulled']} pulled, {ae['pushed']} pushed, {ae['failed']} failed")
+        if "wal" in ss:
+            wal = ss["wal"]
+            print(f"* log: {wal['records']} records in {wal['commits']} commits, {wal['log_bytes']} bytes since "
+                  f"{wal['snapshots']} snapshots, {wal['failed']} failed; {wal['cold']} messages not loaded yet "
+                  f"(recovered in {wal['recovery_ms']:.0f}ms)")
+
+    elif args["node-stats"]:
+        if args["<node-number>"]:
+            stats_ls = [init_gossip_client(args["<node-number>"]).get_node_stats()]
+            stats_of = f"Gossip-Node-{args['<node-number>']}"
+        else:
+            admin = AdminClient()
+            stats_ls = list(admin.query(admin.discover(get_seed_node_ids()), "/STATS:").values())
+            stats_of = f"All {len(stats_ls)} nodes"
+            if not stats_ls:
+                print("No nodes reachable: is the network running?")
+                return
+        stats = merge_stats(stats_ls)
+        counters, gauges, transport = stats["counters"], stats["gauges"], stats["transport"]
+        print(f"{stats_of} stats:")
+        print(f"* {counters['cmds']} commands, {counters['bytes_in']} bytes in, "
+              f"{counters['bytes_out'] + transport['relay_bytes_out']} bytes out")
+        dup_ratio = counters["duplicates"] / counters["relays_in"] if counters["relays_in"] else 0.0
+        print(f"* relays: {counters['relays_in']} in ({counters['first_receptions']} new, {counters['duplicates']} "
+              f"duplicates = {dup_ratio:.1%}, {counters['duplicates_suppressed']} of them suppressed), "
+              f"{counters['relays_out']} out")
+        print(f"* outbound: {transport['relay_failures']} failed, {transport['relays_dropped']} dropped, "
+              f"{transport['outbound_depth']} queued, {counters['relays_unpulled']} held back for want of a body")
+        for name, hist in stats["latency_ns"].items():
+            print(f"* {name} time: {format_latency(hist)}")
+        processes = stats["processes"]
+        print(f"* {processes['threads']} threads in {processes['count']} processes, {gauges['peers']} peers, "
+              f"{gauges['store_entries']} messages stored" +
+              (f" (~{gauges['store_bytes']} bytes)" if "store_bytes" in gauges else ""))
+        if "membership" in stats:
+            mb = stats["membership"]
+            print(f"* membership: {mb['heartbeats']} heartbeats, {mb['missed']} missed; {mb['removed']} peers removed "
+                  f"as dead, {mb['attached']} attached")
+
+    elif args["simulate"]:
+        network_type = get_network_type(args)
+        settings_opts = {"dissemination": get_dissemination(args) or DEFAULT_DISSEMINATION}
+        sim_args = dict(seed=int(args["--seed"]), num_msgs=int(args["--msgs"]), relay_limit=int(args["--relays"]),
+                        latency=float(args["--latency"]) / 1000, jitter=float(args["--jitter"]) / 1000,
+                        loss=float(args["--loss"]), settings_opts=settings_opts)
+        if args["--churn"]:
+            report = simulate_churn(network_type, int(args["--num-nodes"]), get_extra_graph_params(args, network_type),
+                                    churn=float(args["--churn"]), repair=not args["--no-repair"], **sim_args)
+            before, after = report["before"], report["after"]
+            repaired = f"repaired in {report['repair_rounds']} heartbeat rounds" if report["repair_rounds"] else "no repair"
+            print(f"Simulated {before['msgs']} message(s) over a {network_type} network of {before['nodes']} nodes, then "
+                  f"{after['msgs']} more after {report['failed']} nodes failed ({repaired}):")
+            for name, r in (("before", before), ("after", after)):
+                print(f"* {name}: coverage {r['coverage']:.2%}, p50={r['p50'] * 1000:.1f}ms p95={r['p95'] * 1000:.1f}ms, "
+                      f"converged in {r['convergence'] * 1000:.1f}ms, {r['relays_per_msg']:.1f} relays/message")
+                print("  {} component(s), {} isolated node(s), degree min={} mean={:.2f} max={}".format(
+                      r["topology"]["components"], r["topology"]["isolated"], *r["topology"]["degree"]))
+        else:
+            report = simulate(network_type, int(args["--num-nodes"]), get_extra_graph_params(args, network_type),
+                              **sim_args)
+            print(f"Simulated {report['msgs']} message(s) over a {network_type} network of {report['nodes']} nodes:")
+            print(f"* coverage {report['coverage']:.2%}, {report['fully_converged']} message(s) reached every node")
+            print(f"* reception time p50={report['p50'] * 1000:.1f}ms p95={report['p95'] * 1000:.1f}ms, "
+                  f"converged in {report['convergence'] * 1000:.1f}ms")
+            print(f"* {report['relays_per_msg']:.1f} relays/message, {report['frames']} frames ({report['lost']} lost), "
+                  f"{report['pulls']} body pulls")
+
+    elif args["analyze"]:
+        from gossip.analytics import analyze   # numpy & scipy are optional dependencies
+        network_type = get_network_type(args)
+        network = build_network(network_type, int(args["--num-nodes"]), get_extra_graph_params(args, network_type),
+                                seed=int(args["--seed"]))
+        num_origins = int(args["--origins"]) if args["--origins"] else None
+        report = analyze(network, int(args["--relays"]), num_origins, seed=int(args["--seed"]))
+        print(f"Analyzed floods from {report['origins']} origin(s) over a {network_type} network of "
+              f"{report['nodes']} nodes & {report['edges']} edges{'' if report['is_connected'] else ' (disconnected)'}:")
+        print("* degree min={} mean={:.2f} max={}".format(*report["degree"]))
+        print("* eccentricity min={} mean={:.2f} max={}; diameter between {} and {}".format(
+              *report["eccentricity"], *report["diameter_bounds"]))
+        print(f"* {report['relays_per_msg']:.1f} relays/message ({report['relays_per_node']:.2f} per node)")
+        print("* nodes reached by hop:")
+        for hop, reached in enumerate(report["infection_curve"]):
+            print(f"  {hop:>3}: {reached:7.2%}")
+
+    elif args["benchmark"]:
+        network_type = get_network_type(args)
+        report = run_benchmark(network_type, int(args["--num-nodes"]), get_extra_graph_params(args, network_type),
+                               engine=args["--engine"], num_msgs=int(args["--msgs"]), rate=float(args["--rate"]),
+                               relay_limit=int(args["--relays"]), dissemination=get_dissemination(args),
+                               seed=int(args["--seed"]), timeout=float(args["--timeout"]))
+        report_json = json.dumps(report, indent=2)
+        if args["--output"]:
+            with open(args["--output"], "w") as f:
+                f.write(report_json + "\n")
+            print(f"Benchmark report written to {args['--output']}")
+        else:
+            print(report_json)
 
     else:
         raise Exception("this should never be reached!")
@@ -1,41 +1,59 @@
 import socket, json
+from functools import partial
 
-from gossip.constants import PORTS_ORIGIN
+import gossip.wire as wire
+from gossip.constants import PORTS_ORIGIN, GET_PAGE_SIZE
 
 
 class GossipClient:
     """A client interface to connect to a server in a peer-to-peer gossip network."""
 
-    def __init__(self, address):
+    def __init__(self, address, pool=None):
         self.address = address  # this property is used in GossipMessageHandler._get_peers_info
         host, port = self.address.split(":")
         self.host_port_tup = (host, int(port))
         self.id = int(port) - PORTS_ORIGIN
         self.node_name = f"Gossip-Node-{self.id}"
+        self.pool = pool        # a PeerConnectionPool, set when this client is used by a server to reach its peers
 
     def __repr__(self):
         return self.node_name
 
-    def send_message(self, message, is_relay=False, relay_limit=1):
-        """Send a message to the current server."""
+    def send_message(self, message, is_relay=False, relay_limit=1, dissemination=None):
+        """Send a message to the current server, to be spread with the given Dissemination (or the server's default)."""
         cmd = "/RELAY" if is_relay else "/NEW"
-        self._send_to_server(f"{cmd}:{relay_limit}|{message}")
+        header = f"{relay_limit}"
+        if dissemination is not None:
+            header += f",{dissemination.strategy},{dissemination.fanout},{dissemination.max_hops}"
+        self._send_to_server(f"{cmd}:{header}|{message}\n")
 
-    @staticmethod
-    def _parse_msg_id(msg_id: str):
-        if msg_id.count("_") == 1:
-            msg, ts = msg_id.split("_")
-        else:
-            time_rev, msg_rev = msg_id[::-1].split("_", maxsplit=1)     # reversing the ID then splitting at most once on '_' allows message to contain underscores
-            msg, ts = msg_rev[::-1], time_rev[::-1]
-        return msg, int(ts)
+    def send_relays(self, relays):
+        """Relay a batch of (relay_limit, msg_id, node_path, body, dissemination) relays to the current server in a single frame."""
+        if self.pool is not None:
+            self.pool.send(self.host_port_tup, partial(wire.encode_relays, relays))
+            return
+        self._send_to_server(wire.encode_relays_text(relays))
+
+    def get_messages(self, msgs_status_type, msgs_paths_type, since=0, limit=None, page_size=GET_PAGE_SIZE):
+        """Yield the ((msg, ts), paths) of the messages stored by the current server, in the order they were sent.
 
-    def get_messages(self, msgs_status_type, msgs_paths_type):
-        """Fetch a list of all messages stored by the current server."""
-        cmd_data = f"{msgs_status_type}|{msgs_paths_type}"
-        msgs_data = self._send_to_then_get_from_server(f"/GET:{cmd_data}\n")
-        return {GossipClient._parse_msg_id(msg_id): [' ➜ '.join(str(n) for n in nodes) for nodes in msg_paths]
-            for msg_id, msg_paths in msgs_data.items()}
+        Messages are fetched page by page, and yielded as soon as each one is received. Only the messages sent at or
+        after the `since` timestamp (in ns) are fetched, up to `limit` of them.
+        """
+        cursor = [since, ""]
+        while cursor is not None and limit != 0:
+            num_msgs = page_size if limit is None else min(page_size, limit)
+            cmd_data = f"{msgs_status_type}|{msgs_paths_type}|{cursor[0]}|{cursor[1]}|{num_msgs}"
+            for line in self._send_to_then_iter_server_lines(f"/GET:{cmd_data}\n"):
+                if isinstance(line, dict):  # the page's last line
+                    cursor = line["next"]
+                    break
+                _, msg, ts, msg_paths = line
+                yield (msg, ts), [' ➜ '.join(str(n) for n in nodes) for nodes in msg_paths]
+                if limit is not None:
+                    limit -= 1
+            else:
+                break   # the server dropped the connection before the end of the page
 
     def get_peers_info(self, get_ids=False, get_names=False):
         """Fetch the list of peers connected to the current server."""
@@ -50,23 +68,86 @@ class GossipClient:
         else:
             raise Exception("must fetch either peer IDs or peer names")
 
+    def get_queues_stats(self):
+        """Fetch the depth & drop counters of the current server's outbound relay queue to each of its peers."""
+        return self._send_to_then_get_from_server("/QUEUES:\n")
+
+    def get_store_stats(self):
+        """Fetch the size & eviction counters of the current server's message store."""
+        return self._send_to_then_get_from_server("/STORE:\n")
+
+    def get_node_stats(self):
+        """Fetch the current server's counters, latency histograms & gauges (see gossip.metrics)."""
+        return self._send_to_then_get_from_server("/STATS:\n")
+
+    def get_reception_times(self):
+        """Fetch {msg_id: [origin_ts, received_ns, relays_sent]} for every message the current server holds in full."""
+        return self._send_to_then_get_from_server("/TIMES:\n")
+
+    def get_rusage(self):
+        """Fetch the CPU seconds used & peak RSS of the current server's process."""
+        return self._send_to_then_get_from_server("/RUSAGE:\n")
+
+    def sync_digests(self, digest_str):
+        """Exchange message digests with the current server; returns its digest, and the messages missing from ours."""
+        return self._send_to_then_get_from_server(f"/SYNC:{digest_str}\n")
+
+    def push_msgs(self, msgs):
+        """Push to the current server the messages that were missing from its digest."""
+        self._send_to_server(f"/PUSH:{json.dumps(msgs)}\n")
+
+    def pull_msg_bodies(self, msg_ids):
+        """Get the {msg_id: [content, origin_ts]} bodies of the given messages the current server has."""
+        cmd_data = f"/PULL:{json.dumps(msg_ids)}\n"
+        if self.pool is not None:
+            return json.loads(self.pool.request(self.host_port_tup, partial(wire.encode_cmd, cmd_data)))
+        return self._send_to_then_get_from_server(cmd_data)
+
+    def get_node_info(self):
+        """Get the current server's node ID, address, pid, ports origin, and [id, address] of each peer."""
+        return self._send_to_then_get_from_server("/INFO:\n")
+
+    def add_peer(self, node_id):
+        """Connect the current server to the given node as a new peer."""
+        self._send_to_server(f"/ADD:{node_id}\n")
+
     def remove_peer(self, node_id):
         """Remove the given node as a peer from the current server."""
         self._send_to_server(f"/REMOVE:{node_id}\n")
 
+    def heartbeat(self, node_id, timeout=None):
+        """Tell the current server the given node is alive; returns the [node ID, degree] of the server & its peers."""
+        return self._send_to_then_get_from_server(f"/HEARTBEAT:{node_id}\n", timeout)
+
+    def shutdown(self):
+        """Stop the current server."""
+        self._send_to_server("/SHUTDOWN:\n")
+
     def _send_to_server(self, cmd_data):
+        if self.pool is not None:
+            self.pool.send(self.host_port_tup, partial(wire.encode_cmd, cmd_data))
+            return
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
             self._send_to_socket(sock, cmd_data)
 
-    def _send_to_then_get_from_server(self, cmd_data):
+    def _send_to_then_get_from_server(self, cmd_data, timeout=None):
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
             self._send_to_socket(sock, cmd_data)
             response = self._recv_server_full_response(sock)
         return response
 
+    def _send_to_then_iter_server_lines(self, cmd_data):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            self._send_to_socket(sock, cmd_data)
+            with sock.makefile("rb") as rfile:
+                for line in rfile:
+                    yield json.loads(line)
+
     def _send_to_socket(self, sock, cmd_data):
         sock.connect(self.host_port_tup)
-        sock.send(bytes(cmd_data, "utf-8"))
+        sock.sendall(bytes(cmd_data, "utf-8"))
+        sock.shutdown(socket.SHUT_WR)   # one-shot connection: signal the server's command loop that nothing else follows
 
     def _recv_server_full_response(self, sock):
         response_ls = []
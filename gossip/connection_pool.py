@@ -0,0 +1,173 @@
+import socket, select, threading, time
+from collections import defaultdict, deque
+
+import gossip.wire as wire
+from gossip.constants import POOL_CONNECT_TIMEOUT, POOL_IDLE_TIMEOUT, POOL_MAX_IDLE_PER_PEER, OUTBOUND_SEND_TIMEOUT
+
+
+class PeerConnectionPool:
+    """Long-lived, reusable TCP connections to a server's peers, keyed by their (host, port) tuple.
+
+    With wire="binary", each new connection tries to negotiate the binary protocol, and falls back to text
+    if the peer doesn't support it. Idle connections are closed by a background thread once they've been idle for
+    idle_timeout, or as soon as their peer closes them.
+    """
+
+    def __init__(self, max_idle_per_peer=POOL_MAX_IDLE_PER_PEER, idle_timeout=POOL_IDLE_TIMEOUT,
+                 connect_timeout=POOL_CONNECT_TIMEOUT, send_timeout=OUTBOUND_SEND_TIMEOUT, wire="binary"):
+        assert wire in {"binary", "text"}
+        self.max_idle_per_peer = max_idle_per_peer
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.send_timeout = send_timeout
+        self.wire = wire
+        self.bytes_sent = 0
+        self._idle = defaultdict(deque)     # host_port_tup -> deque of (sock, proto, last_used), oldest on the left
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._evictor = None
+
+    def send(self, host_port_tup, encode):
+        """Send data over a pooled connection to the peer, reconnecting once if the connection has gone bad.
+
+        encode is called with the connection's negotiated protocol ("binary" or "text"), and returns the bytes to send.
+        """
+        for attempt in range(2):
+            sock, proto = self._acquire(host_port_tup)
+            try:
+                data = encode(proto)
+                sock.sendall(data)
+            except OSError:
+                sock.close()
+                if attempt:
+                    raise
+                continue
+            self.bytes_sent += len(data)
+            self._release(host_port_tup, sock, proto)
+            return
+
+    def request(self, host_port_tup, encode):
+        """Like send(), but for a command with a response: returns it, read up to the newline that ends it."""
+        for attempt in range(2):
+            sock, proto = self._acquire(host_port_tup)
+            try:
+                data = encode(proto)
+                sock.sendall(data)
+                response = PeerConnectionPool._recv_line(sock)
+            except OSError:
+                sock.close()
+                if attempt:
+                    raise
+                continue
+            self.bytes_sent += len(data)
+            self._release(host_port_tup, sock, proto)
+            return response
+
+    def evict_idle(self):
+        """Close every pooled connection that has been idle for longer than idle_timeout, or closed by its peer."""
+        with self._lock:
+            for host_port_tup, idle in list(self._idle.items()):
+                self._evict_expired(idle, time.monotonic())
+                for conn in [conn for conn in idle if PeerConnectionPool._is_stale(conn[0])]:
+                    idle.remove(conn)
+                    conn[0].close()
+                if not idle:
+                    del self._idle[host_port_tup]
+
+    def drop(self, host_port_tup):
+        """Close every pooled connection to the peer, e.g. once it's removed."""
+        with self._lock:
+            for sock, _, _ in self._idle.pop(host_port_tup, ()):
+                sock.close()
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            for idle in self._idle.values():
+                while idle:
+                    idle.pop()[0].close()
+            self._idle.clear()
+
+    def _acquire(self, host_port_tup):
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle[host_port_tup]
+            self._evict_expired(idle, now)
+            while idle:
+                sock, proto, _ = idle.pop()     # most recently used connection is the likeliest to still be alive
+                if not PeerConnectionPool._is_stale(sock):
+                    return sock, proto
+                sock.close()
+        return self._connect(host_port_tup)
+
+    def _release(self, host_port_tup, sock, proto):
+        with self._lock:
+            idle = self._idle[host_port_tup]
+            if len(idle) < self.max_idle_per_peer and not self._closed.is_set():
+                idle.append((sock, proto, time.monotonic()))
+                return
+        sock.close()
+
+    def _connect(self, host_port_tup):
+        self._start_evictor()
+        if self.wire == "binary":
+            sock = self._open_socket(host_port_tup)
+            if self._negotiate_binary(sock):
+                return sock, "binary"
+            sock.close()    # peers that only speak text drop the connection on the unknown /PROTO command
+        return self._open_socket(host_port_tup), "text"
+
+    def _start_evictor(self):
+        with self._lock:    # started lazily, like the outbound queues' workers
+            if self._evictor is None and not self._closed.is_set():
+                self._evictor = threading.Thread(target=self._evict_idle_periodically, name="pool-evictor", daemon=True)
+                self._evictor.start()
+
+    def _evict_idle_periodically(self):
+        while not self._closed.wait(self.idle_timeout / 2):
+            self.evict_idle()
+
+    def _open_socket(self, host_port_tup):
+        sock = socket.create_connection(host_port_tup, timeout=self.connect_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self.send_timeout)
+        return sock
+
+    @staticmethod
+    def _negotiate_binary(sock):
+        try:
+            sock.sendall(wire.PROTO_BINARY_REQUEST)
+            ack = b""
+            while not ack.endswith(b"\n") and len(ack) < len(wire.PROTO_BINARY_ACK):
+                received = sock.recv(len(wire.PROTO_BINARY_ACK) - len(ack))
+                if not received:
+                    break
+                ack += received
+        except OSError:
+            return False
+        return ack == wire.PROTO_BINARY_ACK
+
+    @staticmethod
+    def _recv_line(sock):
+        # nothing follows the response, so reading past it can't swallow any of a later one
+        chunks = []
+        while not chunks or not chunks[-1].endswith(b"\n"):
+            chunk = sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("connection closed before the end of the response")
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def _evict_expired(self, idle, now):
+        while idle and now - idle[0][-1] > self.idle_timeout:
+            idle.popleft()[0].close()
+
+    @staticmethod
+    def _is_stale(sock):
+        # peers only ever write back the responses to request(), read in full before the connection is released; so a
+        # readable idle socket means the peer closed it (or reset it)
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
@@ -1,2 +1,56 @@
 LOCALHOST = "127.0.0.1"
 PORTS_ORIGIN = 7000
+SERVER_LISTEN_BACKLOG = 128     # pending connections a server's listening socket queues up
+
+# peer connection pooling
+POOL_MAX_IDLE_PER_PEER = 4
+POOL_IDLE_TIMEOUT = 60.0    # seconds
+POOL_CONNECT_TIMEOUT = 5.0  # seconds
+
+# asyncio engine
+ASYNC_MAX_INFLIGHT_RELAYS = 256     # per server; bounds the concurrent outbound relays of a fan-out burst
+ASYNC_MAX_LINE_BYTES = 256 << 20    # longest command line read; /SYNC & /PUSH lines grow with the msgs_box
+ASYNC_WORKER_START_TIMEOUT = 60.0   # seconds start-network waits for the worker processes to be serving
+
+# per-peer outbound relay queues
+OUTBOUND_QUEUE_SIZE = 1024
+OUTBOUND_DROP_POLICY = "drop-oldest"    # or "drop-newest"
+OUTBOUND_SEND_TIMEOUT = 2.0             # seconds
+
+# pulls of the bodies of messages relayed by ID alone (lazy dissemination)
+PULL_QUEUE_SIZE = 1024  # commands whose pulls are waiting on the pullers
+PULL_WORKERS = 4        # threads pulling at once, per (threaded) server
+
+# client
+GET_PAGE_SIZE = 256     # messages fetched per /GET page
+
+# admin client
+ADMIN_MAX_CONNECTIONS = 256     # connections to nodes an admin command keeps open at once
+ADMIN_TIMEOUT = 5.0             # seconds
+
+# binary wire protocol
+WIRE_MAX_FRAME_BYTES = 256 << 20    # largest frame payload read, as for text lines (ASYNC_MAX_LINE_BYTES)
+
+# message IDs
+MSG_ID_SIZE = 16    # bytes in a (hashed) message ID
+
+# message store
+MSG_BASE_BYTES = 512            # estimated overhead of a message's attributes, excluding its content & paths
+MSG_PATH_BYTES = 4              # bytes per path stored in a message's PathTrie (the hops being shared, see paths.HopTrie)
+STORE_MAX_TOMBSTONES = 1 << 20  # IDs of evicted messages remembered, to drop their late relays
+STORE_LOCK_STRIPES = 64         # locks the records of all messages are spread over
+
+# write-ahead log & snapshots
+WAL_FLUSH_INTERVAL = 0.05           # seconds between group commits of the messages updated in the meantime
+WAL_SNAPSHOT_INTERVAL = 600.0       # seconds between compactions of the log into a new snapshot
+WAL_SNAPSHOT_BYTES = 64 << 20       # bytes logged after which the log is compacted early
+
+# membership (failure detection & topology repair)
+MEMBERSHIP_SUSPECT_AFTER = 3    # heartbeats in a row a peer misses before it's declared dead, and replaced
+MEMBERSHIP_TIMEOUT = 1.0        # seconds a heartbeat waits for its answer
+MEMBERSHIP_DEAD_TTL = 60.0      # seconds a dead node isn't attached to again, unless it's heard from
+MEMBERSHIP_VIEW_SIZE = 64       # nodes each node keeps track of, as candidates to attach to
+MEMBERSHIP_VIEW_SAMPLE = 8      # of those, passed on at random with each heartbeat answer
+
+# anti-entropy
+ANTI_ENTROPY_FP_RATE = 0.01     # false positive rate of the Bloom filter digests exchanged
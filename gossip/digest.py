@@ -0,0 +1,45 @@
+import hashlib, math, struct
+
+
+class BloomFilter:
+    """A Bloom filter of message IDs, used as a compact digest of the messages a node holds.
+
+    Nodes pick a fresh salt for every digest, so that a false positive for some message on one exchange
+    is unlikely to recur on the next.
+    """
+
+    HEADER = struct.Struct("!IBQ")  # num_bits, num_hashes, salt
+
+    def __init__(self, num_bits, num_hashes, salt, bits=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.salt = salt
+        self.bits = bytearray((num_bits + 7) // 8) if bits is None else bytearray(bits)
+
+    @classmethod
+    def for_capacity(cls, capacity, fp_rate, salt):
+        capacity = max(capacity, 1)
+        num_bits = max(64, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return cls(num_bits, num_hashes, salt)
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        num_bits, num_hashes, salt = BloomFilter.HEADER.unpack_from(data)
+        return cls(num_bits, num_hashes, salt, data[BloomFilter.HEADER.size:])
+
+    def to_bytes(self):
+        return BloomFilter.HEADER.pack(self.num_bits, self.num_hashes, self.salt) + bytes(self.bits)
+
+    def add(self, msg_id):
+        for i in self._bit_indices(msg_id):
+            self.bits[i >> 3] |= 1 << (i & 7)
+
+    def __contains__(self, msg_id):
+        return all(self.bits[i >> 3] & (1 << (i & 7)) for i in self._bit_indices(msg_id))
+
+    def _bit_indices(self, msg_id):
+        # double hashing: the k indices are h1 + i*h2, both halves of one salted 16-byte digest
+        digest = hashlib.blake2b(bytes.fromhex(msg_id), digest_size=16, salt=self.salt.to_bytes(8, "big")).digest()
+        h1, h2 = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big") | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
@@ -0,0 +1,54 @@
+import random
+from dataclasses import dataclass
+
+
+STRATEGIES = ("flood", "fanout", "lazy")
+
+
+@dataclass(frozen=True)
+class Dissemination:
+    """How a message is spread from each node to its peers.
+
+    * flood:  relay the message, body included, to every peer (but the one it came from)
+    * fanout: like flood, but only to `fanout` peers picked at random on every hop
+    * lazy:   relay only the message's ID, to every peer (or `fanout` random ones); each peer then pulls
+              the body from the node that relayed the ID, if it doesn't have it yet
+
+    A message stops being relayed once its path reaches max_hops hops; 0 means no limit.
+    """
+
+    strategy: str = "flood"
+    fanout:   int = 0
+    max_hops: int = 0
+
+    def __post_init__(self):
+        assert self.strategy in STRATEGIES, f"unknown dissemination strategy: {self.strategy}"
+        assert self.strategy != "fanout" or self.fanout > 0, "the fanout strategy requires a fanout of at least 1"
+
+    @property
+    def is_lazy(self):
+        return self.strategy == "lazy"
+
+    def select_peers(self, peers, rng=random):
+        if self.fanout and len(peers) > self.fanout:
+            return rng.sample(peers, self.fanout)
+        return peers
+
+    def allows_relay(self, node_path):
+        return not self.max_hops or len(node_path) - 1 < self.max_hops
+
+    def to_wire(self):
+        """A compact [strategy index, fanout, max_hops] list; None for the default of flooding without a hop limit."""
+        if self == DEFAULT_DISSEMINATION:
+            return None
+        return [STRATEGIES.index(self.strategy), self.fanout, self.max_hops]
+
+    @staticmethod
+    def from_wire(wire_data):
+        if wire_data is None:
+            return DEFAULT_DISSEMINATION
+        strategy_idx, fanout, max_hops = wire_data
+        return Dissemination(STRATEGIES[strategy_idx], fanout, max_hops)
+
+
+DEFAULT_DISSEMINATION = Dissemination()
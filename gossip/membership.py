@@ -0,0 +1,144 @@
+"""Keeping every node connected to enough live peers, as nodes fail or are removed.
+
+Each node heartbeats its peers; a peer that misses MEMBERSHIP_SUSPECT_AFTER heartbeats in a row is declared dead and
+removed. Whenever a node has fewer peers than its target degree, be it through its failure detector or a /REMOVE, it
+attaches to new ones, both ways. They're picked from the nodes it has heard of through heartbeats, by the placement
+policy of the network's graph generator (see GossipNetwork.place_peers), so that the repaired topology keeps the shape
+the network was built with.
+
+A heartbeat's answer holds the degree of the peer, of each of the peer's own peers, and of a few random nodes the peer
+has heard of in turn. So the peers of a failed node know each other through it, and are the first candidates to close
+the gap it leaves, while the random ones reach across wider gaps, e.g. those left by runs of failed nodes on a ring.
+"""
+
+import random, threading, time
+
+from gossip.client import GossipClient
+from gossip.network import get_placement
+from gossip.constants import MEMBERSHIP_SUSPECT_AFTER, MEMBERSHIP_TIMEOUT, MEMBERSHIP_DEAD_TTL, \
+    MEMBERSHIP_VIEW_SIZE, MEMBERSHIP_VIEW_SAMPLE
+
+
+def answer_heartbeat(ss, node_id):
+    """The server's view of the network, as answered to a heartbeat from the given node (see Membership.get_view)."""
+    if ss.membership is None:
+        return [[ss.node_id, len(ss.peers)]] + [[p.id, None] for p in ss.peers]
+    ss.membership.heard_from(node_id)
+    return ss.membership.get_view()
+
+
+class Membership:
+    """Heartbeats the server's peers, removes those that fail, and attaches to new peers in their place."""
+
+    def __init__(self, ss, interval, placement=None, target_degree=None, rng=random):
+        self.ss = ss
+        self.interval = interval
+        self.placement = get_placement(placement)
+        self.target_degree = target_degree or len(ss.peers)
+        self.rng = rng
+        self.missed = {}    # peer ID -> heartbeats missed in a row
+        self.degrees = {}   # node ID -> degree (None if unknown), of the MEMBERSHIP_VIEW_SIZE nodes last heard of
+        self.dead = {}      # node ID -> time it was declared dead, not to be attached to again for a while
+        self.heartbeats = self.missed_heartbeats = self.removed = self.attached = 0
+        self._lock = threading.Lock()   # heartbeats are answered on the server's threads while a round runs
+        self._stopped = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name="membership", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def get_stats(self):
+        return {"heartbeats": self.heartbeats, "missed": self.missed_heartbeats, "removed": self.removed,
+                "attached": self.attached}
+
+    def _run(self):
+        while not self._stopped.wait(self.interval * random.uniform(0.9, 1.1)):
+            self.run_round()
+
+    def run_round(self):
+        """Heartbeat every peer, remove those found dead, then attach to new peers up to the target degree."""
+        for peer in list(self.ss.peers):
+            try:
+                view = self._heartbeat(peer)
+            except (OSError, ValueError):
+                self._miss(peer.id)
+                continue
+            with self._lock:
+                self.heartbeats += 1
+                self.missed.pop(peer.id, None)
+                self._learn(view)
+        self.repair()
+
+    def get_view(self):
+        """The [node ID, degree] of the server, of each of its peers (None if unknown), and of a sample of the other
+        nodes it has heard of."""
+        with self._lock:
+            view = [[self.ss.node_id, len(self.ss.peers)]] + [[p.id, self.degrees.get(p.id)] for p in self.ss.peers]
+            others = [[node_id, degree] for node_id, degree in self.degrees.items() if node_id != self.ss.node_id]
+        return view + self.rng.sample(others, min(MEMBERSHIP_VIEW_SAMPLE, len(others)))
+
+    def heard_from(self, node_id):
+        # the node still has this one as its peer: it's alive, and a peer both ways again if it had been declared dead
+        with self._lock:
+            self.missed.pop(node_id, None)
+            self.dead.pop(node_id, None)
+            self.ss.add_peer(node_id)
+
+    def repair(self):
+        now = time.monotonic()
+        with self._lock:
+            self.dead = {node_id: t for node_id, t in self.dead.items() if now - t < MEMBERSHIP_DEAD_TTL}
+        while len(self.ss.peers) < self.target_degree:
+            peer_ids = [p.id for p in self.ss.peers]
+            candidates = {node_id: self.target_degree if degree is None else degree
+                          for node_id, degree in self.degrees.items()
+                          if node_id != self.ss.node_id and node_id not in peer_ids and node_id not in self.dead}
+            picked = self.placement.place_peers(self.ss.node_id, peer_ids, candidates,
+                                                self.target_degree - len(peer_ids), self.rng)
+            if not picked:
+                break   # isolated until some node attaches to this one
+            for node_id in picked:
+                try:
+                    self._attach(node_id)
+                except OSError:
+                    with self._lock:
+                        self._declare_dead(node_id)
+                    continue
+                with self._lock:
+                    self.ss.add_peer(node_id)
+                    self.degrees[node_id] = candidates[node_id] + 1
+                    self.attached += 1
+
+    def _learn(self, view):
+        for node_id, degree in view:
+            if node_id not in self.dead:
+                known_degree = self.degrees.pop(node_id, None)
+                self.degrees[node_id] = known_degree if degree is None else degree     # in the order last heard of
+        excess = len(self.degrees) - MEMBERSHIP_VIEW_SIZE
+        if excess > 0:
+            peer_ids = {p.id for p in self.ss.peers}
+            for node_id in [node_id for node_id in self.degrees if node_id not in peer_ids][:excess]:
+                del self.degrees[node_id]
+
+    def _miss(self, node_id):
+        with self._lock:
+            self.missed_heartbeats += 1
+            self.missed[node_id] = self.missed.get(node_id, 0) + 1
+            if self.missed[node_id] >= MEMBERSHIP_SUSPECT_AFTER:
+                self._declare_dead(node_id)
+
+    def _declare_dead(self, node_id):
+        if any(p.id == node_id for p in self.ss.peers):
+            self.ss.remove_peer(node_id)
+            self.removed += 1
+        self.missed.pop(node_id, None)
+        self.degrees.pop(node_id, None)
+        self.dead[node_id] = time.monotonic()
+
+    def _heartbeat(self, peer):
+        return GossipClient(peer.address).heartbeat(self.ss.node_id, timeout=MEMBERSHIP_TIMEOUT)
+
+    def _attach(self, node_id):
+        GossipClient(self.ss.get_node_addr(node_id)).add_peer(self.ss.node_id)
@@ -0,0 +1,89 @@
+"""Always-on counters & latency histograms of a server's command processing, as reported by its /STATS command.
+
+Counters are plain ints, bumped without any locking: under the GIL, the odd update lost between two threads is a
+fair price for keeping locks off the hot path. Latencies are counted into fixed arrays of power-of-2 buckets.
+"""
+
+import time
+from array import array
+
+
+HIST_BUCKETS = 64   # bucket b counts the latencies of b bits, i.e. those in [2^(b-1), 2^b) ns
+
+
+class LatencyHistogram:
+
+    __slots__ = ("counts", "total_ns")
+
+    def __init__(self):
+        self.counts = array("Q", bytes(8 * HIST_BUCKETS))
+        self.total_ns = 0
+
+    def observe(self, ns):
+        self.counts[min(ns.bit_length(), HIST_BUCKETS - 1)] += 1
+        self.total_ns += ns
+
+    def observe_since(self, started_ns):
+        self.observe(time.perf_counter_ns() - started_ns)
+
+    def to_dict(self):
+        """The histogram's non-empty buckets, keyed by their (exclusive) upper bound in ns."""
+        return {
+            "count":    sum(self.counts),
+            "total_ns": self.total_ns,
+            "buckets":  {str(1 << b): c for b, c in enumerate(self.counts) if c},
+        }
+
+
+class NodeMetrics:
+    """The counters & histograms of one server, shared by all of its connections."""
+
+    COUNTERS   = ("cmds", "bytes_in", "bytes_out", "relays_in", "first_receptions", "duplicates",
+                  "duplicates_suppressed", "relays_out", "relays_unpulled")
+    HISTOGRAMS = ("handle", "parse", "fanout")
+
+    def __init__(self):
+        for name in NodeMetrics.COUNTERS:
+            setattr(self, name, 0)
+        self.handle = LatencyHistogram()    # from a command's arrival to its relays being handed off
+        self.parse  = LatencyHistogram()    # decoding relays, from JSON or binary frames
+        self.fanout = LatencyHistogram()    # handing a command's relays off: enqueued (threading) or sent (asyncio)
+
+    def to_dict(self):
+        return {
+            "counters":   {name: getattr(self, name) for name in NodeMetrics.COUNTERS},
+            "latency_ns": {name: getattr(self, name).to_dict() for name in NodeMetrics.HISTOGRAMS},
+        }
+
+
+def merge_stats(stats_ls):
+    """Aggregate the /STATS of many nodes: counters & gauges are summed, and histograms merged bucket by bucket.
+
+    Threads are counted once per process, however many of the nodes it hosts.
+    """
+    merged = {"counters": {}, "latency_ns": {}, "gauges": {}, "transport": {}}
+    process_threads = {}
+    for stats in stats_ls:
+        process_threads[stats["process"]["pid"]] = stats["process"]["threads"]
+        for section in ("counters", "gauges", "transport", "membership"):
+            for name, value in stats.get(section, {}).items():   # membership is only there when it's enabled
+                merged_section = merged.setdefault(section, {})
+                merged_section[name] = merged_section.get(name, 0) + value
+        for name, hist in stats["latency_ns"].items():
+            merged_hist = merged["latency_ns"].setdefault(name, {"count": 0, "total_ns": 0, "buckets": {}})
+            merged_hist["count"] += hist["count"]
+            merged_hist["total_ns"] += hist["total_ns"]
+            for bound, c in hist["buckets"].items():
+                merged_hist["buckets"][bound] = merged_hist["buckets"].get(bound, 0) + c
+    merged["processes"] = {"count": len(process_threads), "threads": sum(process_threads.values())}
+    return merged
+
+
+def hist_percentile(hist, pct):
+    """The upper bound (in ns) of the bucket holding the pct-th percentile of a histogram's latencies."""
+    rank, seen = pct * hist["count"] / 100, 0
+    for bound, c in sorted(hist["buckets"].items(), key=lambda item: int(item[0])):
+        seen += c
+        if seen >= rank:
+            return int(bound)
+    return 0
@@ -0,0 +1,308 @@
+import time, threading
+from array import array
+from collections import OrderedDict
+
+from gossip.paths import PathTrie
+from gossip.dissemination import DEFAULT_DISSEMINATION
+from gossip.constants import MSG_BASE_BYTES, MSG_PATH_BYTES, STORE_MAX_TOMBSTONES, STORE_LOCK_STRIPES
+
+
+# Locks guarding the records of messages, picked by message ID. They're shared by every store in the process,
+# since a thread never holds more than one at a time: a striped lock only ever guards a single message's record.
+_RECORD_LOCKS = [threading.Lock() for _ in range(STORE_LOCK_STRIPES)]
+
+
+class MessageRecord:
+    """The state a server keeps for each message in its msgs_box.
+
+    The relays received from & sent to each peer are counted in fixed-width arrays, indexed by the peer's slot
+    (see ServerSettings.get_peer_slot), and paths are stored in a PathTrie.
+    """
+
+    __slots__ = ("content", "origin_ts", "received_ns", "is_unread", "in_paths", "in_counts", "out_counts",
+                 "dissemination")
+
+    def __init__(self, num_peer_slots, received_ns=None):
+        self.content = None
+        self.origin_ts = None
+        self.received_ns = time.time_ns() if received_ns is None else received_ns  # when its body arrived (see set_body)
+        self.is_unread = True
+        self.in_paths = PathTrie()
+        self.in_counts = array("I", bytes(4 * num_peer_slots))
+        self.out_counts = array("I", bytes(4 * num_peer_slots))
+        self.dissemination = DEFAULT_DISSEMINATION
+
+    def set_body(self, content, origin_ts, received_ns=None):
+        """Store the message's body; the message only counts as received once its body has arrived, which for lazy
+        dissemination is a pull after its ID."""
+        self.content, self.origin_ts = content, origin_ts
+        self.received_ns = time.time_ns() if received_ns is None else received_ns
+
+    def count_in(self, slot):
+        """Count one more relay received from the peer in the given slot, and return its new count."""
+        MessageRecord._grow_to(self.in_counts, slot)
+        self.in_counts[slot] += 1
+        return self.in_counts[slot]
+
+    def get_total_out(self):
+        """The relays of the message sent to all peers."""
+        return sum(self.out_counts)
+
+    def count_out(self, slot):
+        MessageRecord._grow_to(self.out_counts, slot)
+        self.out_counts[slot] += 1
+
+    def set_counts(self, slot, in_count, out_count):
+        MessageRecord._grow_to(self.in_counts, slot)
+        MessageRecord._grow_to(self.out_counts, slot)
+        self.in_counts[slot], self.out_counts[slot] = in_count, out_count
+
+    def get_out_count(self, slot):
+        return self.out_counts[slot] if slot < len(self.out_counts) else 0
+
+    def add_path(self, node_path):
+        self.in_paths.add(node_path)
+
+    @staticmethod
+    def _grow_to(counts, slot):
+        # peers connected after the message was first stored get slots beyond the array's end
+        if slot >= len(counts):
+            counts.extend([0] * (slot + 1 - len(counts)))
+
+
+class MessageStore:
+    """The store of message attributes (the msgs_box) kept by a server, keyed by message ID; never evicts.
+
+    Handlers on many threads share a store: every read-modify-write of a message's record, from its creation on,
+    is done while holding that message's lock_for(msg_id), so handlers of different messages rarely contend.
+
+    A store persisted by a MessageLog (see gossip.wal) also holds "cold" messages: those recovered on restart,
+    whose records stay in the log's files until they're first accessed, then get loaded ("thawed") into the store.
+    """
+
+    def __init__(self):
+        self._msgs = {}
+        self.log = None     # the MessageLog persisting the store, if any
+
+    def __contains__(self, msg_id):
+        return msg_id in self._msgs or self._has_cold(msg_id)
+
+    def __getitem__(self, msg_id):
+        msg_attrs = self._msgs.get(msg_id)
+        return msg_attrs if msg_attrs is not None else self._thaw(msg_id)
+
+    def __setitem__(self, msg_id, msg_attrs):
+        self._insert(msg_id, msg_attrs)
+        self.mark_updated(msg_id)
+
+    def __len__(self):
+        return len(self._msgs) + (self.log.num_cold if self.log is not None else 0)
+
+    def items(self):
+        self._thaw_all()
+        return self._msgs.items()
+
+    def attach_log(self, log):
+        """Persist the store in the MessageLog, which has just recovered the messages of the store before a restart."""
+        self.log = log
+
+    @staticmethod
+    def lock_for(msg_id):
+        # IDs are hex digests, so any of their digits are evenly spread over the stripes
+        return _RECORD_LOCKS[int(msg_id[:8], 16) % STORE_LOCK_STRIPES]
+
+    def get_or_create(self, msg_id, new_msg_attrs):
+        """The message's record, created with new_msg_attrs() if it isn't stored; and whether it was just created.
+
+        Must be called holding lock_for(msg_id), which makes it an atomic check-and-insert.
+        """
+        msg_attrs = self._msgs.get(msg_id)
+        if msg_attrs is None and self._has_cold(msg_id):
+            msg_attrs = self._thaw(msg_id)
+        if msg_attrs is not None:
+            return msg_attrs, False
+        msg_attrs = self[msg_id] = new_msg_attrs()
+        return msg_attrs, True
+
+    def values(self):
+        self._thaw_all()
+        return self._msgs.values()
+
+    def get_loaded(self, msg_id):
+        """The message's record if it's loaded in memory, else None; unlike store[msg_id], never thaws it."""
+        return self._msgs.get(msg_id)
+
+    def get_loaded_ids(self):
+        return list(self._msgs)
+
+    def touch(self, msg_id):
+        """Record that the message's attributes were updated, e.g. a new path was added."""
+        self._touch(msg_id)
+        self.mark_updated(msg_id)
+
+    def mark_updated(self, msg_id):
+        """Record that the message's attributes were updated in a way that doesn't change their size, e.g. read."""
+        if self.log is not None:
+            self.log.mark(msg_id)
+
+    def is_evicted(self, msg_id):
+        return False
+
+    def get_evicted_ids(self):
+        """The IDs of the evicted messages whose tombstones are still kept."""
+        return []
+
+    def get_stats(self):
+        # the estimated bytes held are only tracked by stores bounded in bytes (see BoundedMessageStore)
+        return {
+            "entries":     len(self),
+            "evictions":   0,
+            "expirations": 0,
+            "tombstones":  0,
+        }
+
+    def _insert(self, msg_id, msg_attrs):
+        self._msgs[msg_id] = msg_attrs
+        self._touch(msg_id)
+
+    def _touch(self, msg_id):
+        pass
+
+    def _has_cold(self, msg_id):
+        return self.log is not None and self.log.has_cold(msg_id) and not self.is_evicted(msg_id)
+
+    def _thaw(self, msg_id):
+        if not self._has_cold(msg_id):
+            raise KeyError(msg_id)
+        with self.log.thaw_lock:
+            msg_attrs = self._msgs.get(msg_id)
+            if msg_attrs is None:   # unless another thread thawed it first
+                msg_attrs = self.log.thaw(msg_id)
+                self._insert(msg_id, msg_attrs)
+        return msg_attrs
+
+    def _thaw_all(self):
+        if self.log is None or not self.log.num_cold:
+            return
+        for msg_id in self.log.get_cold_ids():
+            if msg_id not in self._msgs and not self.is_evicted(msg_id):
+                self._thaw(msg_id)
+
+    @staticmethod
+    def _sizeof(msg_attrs):
+        # a cheap estimate rather than an exact count: a fixed per-message overhead, plus the content & every path;
+        # the hops of paths are shared by all messages (see gossip.paths.HopTrie), so no message accounts for them
+        content = msg_attrs.content or ""
+        return MSG_BASE_BYTES + len(content) + MSG_PATH_BYTES * len(msg_attrs.in_paths)
+
+
+class BoundedMessageStore(MessageStore):
+    """A MessageStore bounded in entries and/or estimated bytes, evicting the least recently updated messages first.
+
+    The size of each message is only estimated (see _sizeof) when max_bytes is set, and the total kept as they
+    change. Messages not updated for ttl seconds expire, as soon as any message is stored or updated, or the store's
+    stats are read. The IDs of evicted & expired messages are kept as tombstones,
+    so that late relays of them are dropped instead of being re-accepted and relayed all over again.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None, max_tombstones=STORE_MAX_TOMBSTONES):
+        super().__init__()
+        self._msgs = OrderedDict()  # least recently updated first
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_tombstones = max_tombstones
+        self.total_bytes = self.evictions = self.expirations = 0
+        self._sizes = {} if max_bytes is not None else None    # msg_id -> estimated bytes held by its attributes
+        self._touched_at = {}
+        self._tombstones = OrderedDict()    # 16-byte IDs of evicted messages, oldest first
+        self._lru_lock = threading.RLock()  # guards the LRU order & byte count, which span all messages
+
+    def _insert(self, msg_id, msg_attrs):
+        with self._lru_lock:
+            super()._insert(msg_id, msg_attrs)
+
+    def _touch(self, msg_id, touched_at=None):
+        with self._lru_lock:
+            if msg_id not in self._msgs:    # evicted while its record was being updated
+                return
+            if self._sizes is not None:
+                size = MessageStore._sizeof(self._msgs[msg_id])
+                self.total_bytes += size - self._sizes.get(msg_id, 0)
+                self._sizes[msg_id] = size
+            self._touched_at[msg_id] = time.monotonic() if touched_at is None else touched_at
+            self._msgs.move_to_end(msg_id)
+            self._enforce_bounds()
+
+    def attach_log(self, log):
+        # the recovered messages are all loaded, least recently updated first, so that they're held to the bounds:
+        # those that don't fit, or have expired since they were logged, are evicted (and logged as such) right away
+        super().attach_log(log)
+        with self._lru_lock:
+            for msg_id in log.get_evicted_ids():
+                self._add_tombstone(bytes.fromhex(msg_id))
+            now_ns, now = time.time_ns(), time.monotonic()
+            for msg_id, msg_attrs, updated_ns in log.iter_cold_by_age():
+                self._msgs[msg_id] = msg_attrs
+                self._touch(msg_id, touched_at=now - max(0, now_ns - updated_ns) / 1e9)
+            log.drop_cold()
+
+    def is_evicted(self, msg_id):
+        return bytes.fromhex(msg_id) in self._tombstones
+
+    def get_evicted_ids(self):
+        with self._lru_lock:
+            return [msg_id.hex() for msg_id in self._tombstones]
+
+    def get_stats(self):
+        with self._lru_lock:
+            self._expire()  # even if no message was stored or updated since they expired
+            stats = {
+                "entries":     len(self),
+                "evictions":   self.evictions,
+                "expirations": self.expirations,
+                "tombstones":  len(self._tombstones),
+            }
+            if self._sizes is not None:
+                stats["bytes"] = self.total_bytes
+            return stats
+
+    def _enforce_bounds(self):
+        self._expire()
+        # the newest message is always kept, even if it alone exceeds max_bytes
+        while len(self._msgs) > 1 and (self._over(len(self._msgs), self.max_entries) or
+                                       self._over(self.total_bytes, self.max_bytes)):
+            self._evict_oldest()
+            self.evictions += 1
+
+    def _expire(self):
+        if self.ttl is None:
+            return
+        expired_before = time.monotonic() - self.ttl
+        while self._msgs and self._touched_at[next(iter(self._msgs))] < expired_before:
+            self._evict_oldest()
+            self.expirations += 1
+
+    def _evict_oldest(self):
+        msg_id, _ = self._msgs.popitem(last=False)
+        if self._sizes is not None:
+            self.total_bytes -= self._sizes.pop(msg_id)
+        del self._touched_at[msg_id]
+        self._add_tombstone(bytes.fromhex(msg_id))
+        self.mark_updated(msg_id)   # so that its tombstone is logged
+
+    def _add_tombstone(self, msg_id_bytes):
+        self._tombstones[msg_id_bytes] = None
+        self._tombstones.move_to_end(msg_id_bytes)
+        if len(self._tombstones) > self.max_tombstones:
+            self._tombstones.popitem(last=False)
+
+    @staticmethod
+    def _over(value, bound):
+        return bound is not None and value > bound
+
+
+def new_msg_store(max_entries=None, max_bytes=None, ttl=None):
+    if max_entries is None and max_bytes is None and ttl is None:
+        return MessageStore()
+    return BoundedMessageStore(max_entries, max_bytes, ttl)
@@ -4,8 +4,9 @@ import networkx as nx
 
 class GossipNetwork(ABC):
 
-    def __init__(self, num_nodes):
+    def __init__(self, num_nodes, seed=None):
         self.num_nodes = num_nodes
+        self.seed = seed    # for the random graph generators, so that a network can be reproduced
         self.G = self._get_network_graph()
         nx.relabel_nodes(self.G, {0: self.num_nodes}, copy=False)   # change graph to be 1-indexed
         self.edge_color = "black"   # the default edge color to be used
@@ -17,6 +18,12 @@ class GossipNetwork(ABC):
     def get_peers_for_node(self, node_id):
         return self.G[node_id]  # this returns an AtlasView (read-only dict-of-dict data struct) object
 
+    @staticmethod
+    def place_peers(node_id, peer_ids, candidates, num_peers, rng):
+        """Pick num_peers of the candidates ({node ID: degree}) for a node that lost some of its peers to attach to,
+        the way the network's graph generator would have; any node may be picked by default."""
+        return rng.sample(sorted(candidates), min(num_peers, len(candidates)))
+
     def show_graph(self):
         import matplotlib.pyplot as plt
         self._draw_network()
@@ -45,30 +52,68 @@ class CircularNetwork(GossipNetwork):
     def _draw_network(self):
         nx.draw_circular(self.G, with_labels=True, node_color="cyan", edge_color="black")
 
+    @staticmethod
+    def place_peers(node_id, peer_ids, candidates, num_peers, rng):
+        # close the ring: the nearest node on each side left without a peer, then the nearest ones overall
+        ring_size = max([node_id, *peer_ids, *candidates])
+        offset = lambda n: (n - node_id + ring_size // 2) % ring_size - ring_size // 2    # signed distance on the ring
+        by_distance = sorted(candidates, key=lambda n: (abs(offset(n)), n))
+        picked = []
+        for side in (1, -1):
+            if not any(offset(p) * side > 0 for p in peer_ids):
+                picked += [n for n in by_distance if offset(n) * side > 0][:1]
+        picked += [n for n in by_distance if n not in picked]
+        return picked[:num_peers]
+
 
 class RandomRegularNetwork(GossipNetwork):
 
-    def __init__(self, num_nodes, k_degrees):
+    def __init__(self, num_nodes, k_degrees, seed=None):
         self.k_deg = self.edge_cardinality = k_degrees
-        super().__init__(num_nodes)
+        super().__init__(num_nodes, seed)
 
     def _get_network_graph(self):
-        return nx.random_regular_graph(self.k_deg, self.num_nodes)
+        return nx.random_regular_graph(self.k_deg, self.num_nodes, seed=self.seed)
 
     def _draw_network(self):
         nx.draw_networkx(self.G, node_color="yellow", edge_color=self._get_dynamic_edge_colors())
 
+    @staticmethod
+    def place_peers(node_id, peer_ids, candidates, num_peers, rng):
+        # keep the graph as regular as it can be: the nodes with the fewest peers first (likely those that lost one
+        # too), at random among equals
+        return sorted(candidates, key=lambda n: (candidates[n], rng.random()))[:num_peers]
+
 
 class PowerlawClusterNetwork(GossipNetwork):
 
-    def __init__(self, num_nodes, m_edges=3, p_triangle=0.5):
+    def __init__(self, num_nodes, m_edges=3, p_triangle=0.5, seed=None):
         self.m_edges = self.edge_cardinality = m_edges
         self.p_triangle = p_triangle
-        super().__init__(num_nodes)
+        super().__init__(num_nodes, seed)
 
     def _get_network_graph(self):
-        return nx.powerlaw_cluster_graph(self.num_nodes, self.m_edges, self.p_triangle)
+        return nx.powerlaw_cluster_graph(self.num_nodes, self.m_edges, self.p_triangle, seed=self.seed)
 
     def _draw_network(self):
         pos = nx.shell_layout(self.G)
         nx.draw_networkx(self.G, pos=pos, node_color="lawngreen", edge_color=self._get_dynamic_edge_colors())
+
+    @staticmethod
+    def place_peers(node_id, peer_ids, candidates, num_peers, rng):
+        # preferential attachment, like the generator's: each node is picked with a probability proportional to its degree
+        remaining, picked = dict(candidates), []
+        while remaining and len(picked) < num_peers:
+            node = rng.choices(list(remaining), weights=[d + 1 for d in remaining.values()])[0]
+            picked.append(node)
+            del remaining[node]
+        return picked
+
+
+def get_placement(network_type):
+    """The GossipNetwork class whose place_peers attaches new peers the way the network type's graph generator does."""
+    return {
+        "circular": CircularNetwork,
+        "random":   RandomRegularNetwork,
+        "powerlaw": PowerlawClusterNetwork,
+    }.get(network_type, GossipNetwork)
@@ -0,0 +1,100 @@
+import threading, time
+from collections import deque
+
+from gossip.constants import OUTBOUND_QUEUE_SIZE, OUTBOUND_DROP_POLICY
+
+
+def relay_key(relay):
+    """A hashable stand-in for a relay: two relays with the same key are the same relay, as a message's body &
+    dissemination never change, and only go along with some of its relays."""
+    relay_limit, msg_id, node_path, body, _ = relay
+    return relay_limit, msg_id, tuple(node_path), body is not None
+
+
+class PeerOutboundQueue:
+    """A bounded queue of relays to one peer, drained by a dedicated worker thread.
+
+    When the queue is full, the drop policy decides whether the oldest queued relay or the incoming one is discarded.
+    A relay identical to one that is still queued is coalesced into it rather than queued twice.
+    The worker sends up to max_batch_size relays per frame, waiting at most max_batch_delay seconds for a batch to fill.
+    """
+
+    def __init__(self, peer, maxsize=OUTBOUND_QUEUE_SIZE, drop_policy=OUTBOUND_DROP_POLICY, max_batch_size=1,
+                 max_batch_delay=0.0):
+        assert drop_policy in {"drop-oldest", "drop-newest"}
+        assert max_batch_size >= 1
+        self.peer = peer
+        self.maxsize = maxsize
+        self.drop_policy = drop_policy
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self.enqueued = self.sent = self.dropped = self.coalesced = self.failed = self.frames = 0
+        self._items = deque()   # pending (relay_limit, msg_id, node_path, body, dissemination) relays
+        self._keys = set()      # relay_key() of every pending relay, to coalesce duplicates without scanning _items
+        self._cond = threading.Condition()
+        self._worker = None
+        self._closed = False
+
+    def put(self, relay):
+        with self._cond:
+            if self._closed:
+                return
+            key = relay_key(relay)
+            if key in self._keys:
+                self.coalesced += 1
+                return
+            if len(self._items) >= self.maxsize:
+                self.dropped += 1
+                if self.drop_policy == "drop-newest":
+                    return
+                self._keys.discard(relay_key(self._items.popleft()))
+            self._items.append(relay)
+            self._keys.add(key)
+            self.enqueued += 1
+            self._cond.notify()
+            if self._worker is None:    # started lazily, so settings can be built without spawning any threads
+                self._worker = threading.Thread(target=self._drain, name=f"outbound-{self.peer.id}", daemon=True)
+                self._worker.start()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._items.clear()
+            self._keys.clear()
+            self._cond.notify()
+
+    def get_stats(self):
+        return {
+            "depth":     len(self._items),
+            "enqueued":  self.enqueued,
+            "sent":      self.sent,
+            "dropped":   self.dropped,
+            "coalesced": self.coalesced,
+            "failed":    self.failed,
+            "frames":    self.frames,
+        }
+
+    def _drain(self):
+        while (batch := self._take_batch()) is not None:
+            try:
+                self.peer.send_relays(batch)
+                self.sent += len(batch)
+                self.frames += 1
+            except OSError:     # includes timeouts; an unreachable peer only costs its own queue
+                self.failed += len(batch)
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._items and not self._closed:
+                self._cond.wait()
+            deadline = time.monotonic() + self.max_batch_delay
+            while len(self._items) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if self._closed:
+                return None
+            batch = [self._items.popleft() for _ in range(min(len(self._items), self.max_batch_size))]
+            self._keys.difference_update(relay_key(relay) for relay in batch)
+            return batch
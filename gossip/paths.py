@@ -0,0 +1,117 @@
+import threading
+from array import array
+
+
+class HopTrie:
+    """The hops of the paths of every message in the process, as a prefix tree: paths share their common hops, across
+    messages too, since those relayed along the same routes reach a node by the same paths.
+
+    Each hop is a fixed-width record in a single array, pointing back to the hop before it, so memory grows with
+    the number of unique prefixes rather than the total length of all paths; a path is referred to by its last hop.
+    Hops are never removed, as any number of messages may refer to them.
+    """
+
+    # each hop is HOP_FIELDS consecutive ints in _hops; the hop at index 0 is a sentinel root before every first hop
+    HOP_FIELDS = 3
+    NODE_ID, PARENT, DEPTH = range(HOP_FIELDS)
+    NONE = -1
+
+    def __init__(self):
+        self._hops = array("i", (HopTrie.NONE, HopTrie.NONE, 0))
+        self._children = {}     # (parent hop << 32 | node ID) -> child hop
+        self._lock = threading.Lock()   # guards the addition of hops; lookups go without it
+
+    def __len__(self):
+        """The number of unique hops stored."""
+        return len(self._hops) // HopTrie.HOP_FIELDS - 1
+
+    def add(self, node_path):
+        """The last hop of the path, adding the hops it doesn't share with any path stored before."""
+        hop = 0
+        for node_id in node_path:
+            child = self._children.get(hop << 32 | node_id)
+            hop = child if child is not None else self._add_child(hop, node_id)
+        return hop
+
+    def get_depth(self, hop):
+        return self._hops[hop * HopTrie.HOP_FIELDS + HopTrie.DEPTH]
+
+    def to_list(self, hop):
+        hops, F = self._hops, HopTrie.HOP_FIELDS
+        path = []
+        while hop != 0:
+            path.append(hops[hop * F + HopTrie.NODE_ID])
+            hop = hops[hop * F + HopTrie.PARENT]
+        path.reverse()
+        return path
+
+    def _add_child(self, hop, node_id):
+        with self._lock:
+            child = self._children.get(hop << 32 | node_id)
+            if child is None:   # unless another thread added it first
+                child = len(self._hops) // HopTrie.HOP_FIELDS
+                self._hops.extend((node_id, hop, self.get_depth(hop) + 1))
+                self._children[hop << 32 | node_id] = child
+            return child
+
+
+# shared by every PathTrie in the process, as _RECORD_LOCKS are by every msgs_box
+HOPS = HopTrie()
+
+
+class PathTrie:
+    """All the paths a message took to reach a node, stored in the process's HopTrie; the message itself only keeps
+    the last hop of each path, and the lengths of its shortest & longest paths, maintained as paths are added.
+    """
+
+    __slots__ = ("_ends", "_shortest", "_longest")
+
+    def __init__(self):
+        # the last hop of each path added, in order of arrival (a path may be added repeatedly); most messages only
+        # ever arrive by a single path, so the array is only allocated for a second one
+        self._ends = None
+        self._shortest = self._longest = 0
+
+    def __len__(self):
+        return 0 if self._ends is None else 1 if isinstance(self._ends, int) else len(self._ends)
+
+    def __iter__(self):
+        return (HOPS.to_list(end) for end in self._iter_ends())
+
+    def add(self, node_path):
+        end = HOPS.add(node_path)
+        depth = HOPS.get_depth(end)
+        if self._ends is None:
+            self._ends, self._shortest, self._longest = end, depth, depth
+            return
+        if isinstance(self._ends, int):
+            self._ends = array("i", (self._ends,))
+        self._ends.append(end)
+        self._shortest, self._longest = min(self._shortest, depth), max(self._longest, depth)
+
+    def to_array(self):
+        """The paths, as the length of each followed by its node IDs, e.g. to persist them; from_array() adds them back."""
+        flat = array("i")
+        for path in self:
+            flat.append(len(path))
+            flat.extend(path)
+        return flat
+
+    @classmethod
+    def from_array(cls, flat):
+        trie, pos = cls(), 0
+        while pos < len(flat):
+            trie.add(flat[pos + 1:pos + 1 + flat[pos]])
+            pos += 1 + flat[pos]
+        return trie
+
+    def get_shortest(self):
+        return [HOPS.to_list(end) for end in self._iter_ends() if HOPS.get_depth(end) == self._shortest]
+
+    def get_longest(self):
+        return [HOPS.to_list(end) for end in self._iter_ends() if HOPS.get_depth(end) == self._longest]
+
+    def _iter_ends(self):
+        if self._ends is None:
+            return ()
+        return (self._ends,) if isinstance(self._ends, int) else self._ends
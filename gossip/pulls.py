@@ -0,0 +1,60 @@
+import threading
+from collections import deque
+
+from gossip.constants import PULL_QUEUE_SIZE, PULL_WORKERS
+
+
+class BodyPuller:
+    """A bounded queue of body pulls, drained by a few worker threads shared by all of a server's connections.
+
+    Each job pulls the bodies of the messages a command received by ID alone, then sends that command's relays of
+    them on; so the handler that queued it goes on to its next command instead of waiting on the round trips.
+    When the queue is full, the incoming job is dropped, and put() returns False.
+    """
+
+    def __init__(self, maxsize=PULL_QUEUE_SIZE, num_workers=PULL_WORKERS):
+        self.maxsize = maxsize
+        self.num_workers = num_workers
+        self.enqueued = self.dropped = 0
+        self._jobs = deque()
+        self._cond = threading.Condition()
+        self._workers = []
+        self._closed = False
+
+    def put(self, job):
+        with self._cond:
+            if self._closed or len(self._jobs) >= self.maxsize:
+                self.dropped += 1
+                return False
+            self._jobs.append(job)
+            self.enqueued += 1
+            self._cond.notify()
+            # started lazily, and one at a time as jobs queue up, so that a node without lazy messages spawns none
+            if len(self._workers) < self.num_workers and (not self._workers or len(self._jobs) > 1):
+                worker = threading.Thread(target=self._drain, name=f"puller-{len(self._workers)}", daemon=True)
+                self._workers.append(worker)
+                worker.start()
+            return True
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._jobs.clear()
+            self._cond.notify_all()
+
+    def get_stats(self):
+        return {
+            "depth":    len(self._jobs),
+            "enqueued": self.enqueued,
+            "dropped":  self.dropped,
+        }
+
+    def _drain(self):
+        while (job := self._take_job()) is not None:
+            job()
+
+    def _take_job(self):
+        with self._cond:
+            while not self._jobs and not self._closed:
+                self._cond.wait()
+            return None if self._closed else self._jobs.popleft()
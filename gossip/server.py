@@ -1,10 +1,21 @@
-import socket, json, time
+import os, socket, json, time, hashlib, heapq, random, resource, threading
+from collections import defaultdict
 from dataclasses import dataclass, field
-from collections import Counter
+from functools import partial
 
 from socketserver import ThreadingTCPServer, StreamRequestHandler
+import gossip.wire as wire
 from gossip.client import GossipClient
-from gossip.constants import PORTS_ORIGIN
+from gossip.connection_pool import PeerConnectionPool
+from gossip.outbound import PeerOutboundQueue
+from gossip.pulls import BodyPuller
+from gossip.msg_store import MessageStore, MessageRecord, new_msg_store
+import gossip.anti_entropy as ae
+import gossip.membership as mb
+import gossip.wal as wal
+from gossip.metrics import NodeMetrics
+from gossip.dissemination import Dissemination, DEFAULT_DISSEMINATION
+from gossip.constants import PORTS_ORIGIN, MSG_ID_SIZE, SERVER_LISTEN_BACKLOG
 
 
 @dataclass
@@ -13,83 +24,333 @@ class ServerSettings:
     port:       int
     peer_addrs: list[str]
     node_id:    int = None
+    relay_batch_size:  int = 1        # max relays coalesced into a single frame to a peer; 1 disables batching
+    relay_batch_delay: float = 0.0    # seconds a peer's outbound queue waits for a batch to fill up
+    wire_protocol:     str = "binary" # protocol to relay to peers with: "binary", or "text" (see gossip.wire)
+    store_max_entries: int = None     # bounds of the msgs_box; leaving all 3 unset keeps every message forever
+    store_max_bytes:   int = None
+    store_ttl:         float = None   # seconds
+    anti_entropy_interval: float = None     # seconds between anti-entropy rounds; None disables anti-entropy
+    dissemination:     Dissemination = DEFAULT_DISSEMINATION  # for new messages that don't specify their own
+    data_dir:          str = None     # directory to persist the msgs_box in (see gossip.wal); None keeps it in memory
+    membership_interval:  float = None  # seconds between heartbeats to the peers; None disables failure repair
+    membership_placement: str = None    # network type whose graph generator places new peers; None picks them at random
+    target_degree:     int = None     # peers repair keeps the node at; its initial number of peers if unset
     peers:      list[GossipClient] = field(init=False)
-    msgs_box:   dict[dict] = field(default_factory=dict)
+    pool:       PeerConnectionPool = field(init=False, repr=False)
+    outbound:   dict[int, PeerOutboundQueue] = field(init=False, repr=False)
+    puller:     BodyPuller = field(init=False, repr=False)
+    msgs_box:   MessageStore = field(init=False, repr=False)
+    peer_slots: dict[int, int] = field(init=False, repr=False)
+    peer_slots_lock: threading.Lock = field(init=False, repr=False)
+    peers_lock: threading.Lock = field(init=False, repr=False)
+    anti_entropy: ae.AntiEntropy = field(init=False, repr=False)
+    membership: mb.Membership = field(init=False, repr=False)
+    msg_log:    wal.MessageLog = field(init=False, repr=False)
+    metrics:    NodeMetrics = field(init=False, repr=False)
 
     def __post_init__(self):
         self.node_id = int(self.port) - PORTS_ORIGIN
-        self.peers = [GossipClient(addr) for addr in self.peer_addrs]
+        self.metrics = NodeMetrics()
+        self.pool = PeerConnectionPool(wire=self.wire_protocol)
+        self.puller = BodyPuller()
+        self.msgs_box = new_msg_store(self.store_max_entries, self.store_max_bytes, self.store_ttl)
+        self.peers = [self._new_peer(addr) for addr in self.peer_addrs]
+        self.peer_slots = {p.id: slot for slot, p in enumerate(self.peers)}
+        self.peer_slots_lock = threading.Lock()
+        self.peers_lock = threading.Lock()  # guards changes to the peers, and the creation of their outbound queues
+        self.anti_entropy = ae.AntiEntropy(self, self.anti_entropy_interval) if self.anti_entropy_interval else None
+        self.membership = mb.Membership(self, self.membership_interval, self.membership_placement,
+                                        self.target_degree) if self.membership_interval else None
+        self.msg_log = wal.MessageLog(self, self.data_dir) if self.data_dir else None   # recovers the msgs_box
+        self.outbound = {p.id: self._new_outbound_queue(p) for p in self.peers}
+
+    def get_peer_slot(self, node_id):
+        """The index of the node in each MessageRecord's counter arrays; slots are never reused, even after removal."""
+        slot = self.peer_slots.get(node_id)
+        if slot is None:
+            with self.peer_slots_lock:  # or two handlers seeing two new nodes could give both the same slot
+                slot = self.peer_slots.setdefault(node_id, len(self.peer_slots))
+        return slot
+
+    def get_node_addr(self, node_id):
+        """The address of a peer of this server, or of any other node of the network, by its ID."""
+        for p in self.peers:
+            if p.id == node_id:
+                return p.address
+        return f"{self.hostname}:{PORTS_ORIGIN + node_id}"
+
+    def add_peer(self, node_id):
+        """Connect to the node as a new peer; its ID keeps any slot it had before being removed."""
+        with self.peers_lock:
+            if node_id == self.node_id or any(p.id == node_id for p in self.peers):
+                return
+            peer = self._new_peer(self.get_node_addr(node_id))
+            # the lists are replaced rather than updated in place, as handlers on other threads iterate over them
+            self.peers = self.peers + [peer]
+            self.peer_addrs = self.peer_addrs + [peer.address]
+
+    def remove_peer(self, node_id):
+        with self.peers_lock:
+            peer_addr = self.get_node_addr(node_id)
+            self.peers = [p for p in self.peers if p.id != node_id]
+            self.peer_addrs = [addr for addr in self.peer_addrs if addr != peer_addr]
+            if node_id in self.outbound:
+                self.outbound.pop(node_id).close()
+        if self.pool is not None:
+            host, port = peer_addr.split(":")
+            self.pool.drop((host, int(port)))
+
+    def get_outbound_queue(self, peer):
+        """The peer's outbound queue; None if it's no longer a peer, e.g. removed while its relays were being made."""
+        q = self.outbound.get(peer.id)
+        if q is None:
+            with self.peers_lock:
+                if any(p.id == peer.id for p in self.peers):
+                    q = self.outbound.setdefault(peer.id, self._new_outbound_queue(peer))
+        return q
+
+    def _new_peer(self, addr):
+        return GossipClient(addr, pool=self.pool)
+
+    def _new_outbound_queue(self, peer):
+        return PeerOutboundQueue(peer, max_batch_size=self.relay_batch_size, max_batch_delay=self.relay_batch_delay)
 
 
 class GossipServer:
     """A server that participates in a peer-to-peer gossip network."""
 
-    def __init__(self, server_address, peer_addrs):
+    settings_class = ServerSettings
+
+    def __init__(self, server_address, peer_addrs, **settings_opts):
         """Initialize a server with a list of peer addresses.
 
-        Peer addresses are in the form HOSTNAME:PORT.
+        Peer addresses are in the form HOSTNAME:PORT; settings_opts are passed on to ServerSettings.
         """
         hostname, port = server_address.split(":")
         self.host_port_tup = (hostname, int(port))
-        self.ss = ServerSettings(hostname, port, peer_addrs)
+        self.ss = self.settings_class(hostname, port, peer_addrs, **settings_opts)
 
     def start(self):
-        print(f"Starting Gossip-Node-{self.ss.node_id} with peers:".ljust(36) + f" {', '.join(str(p.id) for p in self.ss.peers)}")
+        self._print_start_banner()
+        self._start_background_tasks()
         with GossipTCPServer(self.host_port_tup, GossipMessageHandler, self.ss) as server:
             server.serve_forever()
+        self._stop_background_tasks()
+
+    def _start_background_tasks(self):
+        if self.ss.anti_entropy is not None:
+            self.ss.anti_entropy.start()
+        if self.ss.msg_log is not None:
+            self.ss.msg_log.start()
+        if self.ss.membership is not None:
+            self.ss.membership.start()
+
+    def _stop_background_tasks(self):
+        if self.ss.anti_entropy is not None:
+            self.ss.anti_entropy.stop()
+        if self.ss.msg_log is not None:
+            self.ss.msg_log.stop()  # commits the last updates
+        if self.ss.membership is not None:
+            self.ss.membership.stop()
+        for q in self.ss.outbound.values():
+            q.close()
+        self.ss.puller.close()
+        self.ss.pool.close()
+
+    def _print_start_banner(self):
+        print(f"Starting Gossip-Node-{self.ss.node_id} with peers:".ljust(36) + f" {', '.join(str(p.id) for p in self.ss.peers)}")
+        if self.ss.msg_log is not None and len(self.ss.msgs_box):
+            print(f"  recovered {len(self.ss.msgs_box)} messages from {self.ss.msg_log.dir} "
+                  f"in {self.ss.msg_log.recovery_secs * 1000:.0f}ms")
 
 
 class GossipTCPServer(ThreadingTCPServer):
 
+    daemon_threads = True   # peer connections are long-lived, so don't wait on their handler threads when shutting down
+    allow_reuse_address = True
+    request_queue_size = SERVER_LISTEN_BACKLOG   # bursts of one-shot client connections overflow the default of 5
+
     def __init__(self, host_port_tup, request_handler, server_settings):
         super().__init__(host_port_tup, request_handler)
         self.ss = server_settings
 
 
-class GossipMessageHandler(StreamRequestHandler):
+class GossipCommandProcessor:
+    """The gossip command logic shared by every server engine.
+
+    Subclasses provide the server settings as `self.ss`, and implement `_write_response` & `_send_relays`
+    to suit their transport.
+    """
+
+    rng = random   # source of the random peer selections of fanout dissemination
 
     # TODO: make appropriate properties private, e.g. self._msg_id
 
-    def handle(self):
-        self.cmd, self.msg_data = self.rfile.readline().strip().decode().split(":", maxsplit=1)
+    def _proc_cmd_line(self, line: str, num_bytes=None):
+        """Process a command line; num_bytes is its size as received, framing included, if not a text protocol line."""
+        self.cmd, self.msg_data = line.split(":", maxsplit=1)
+        self._begin_cmd()
+        self.ss.metrics.bytes_in += len(line.encode()) + 1 if num_bytes is None else num_bytes
         self._get_cmd_handler()()
+        self._finish_cmd()
+
+    def _proc_frame(self, frame_type, payload: bytes):
+        if frame_type == wire.FRAME_CMD:
+            self._proc_cmd_line(payload.decode(), wire.FRAME_HEADER.size + len(payload))
+        elif frame_type == wire.FRAME_RELAYS:
+            self.cmd = "/RELAYS"
+            self._begin_cmd()
+            self.ss.metrics.bytes_in += wire.FRAME_HEADER.size + len(payload)
+            self._proc_relays(self._parse(wire.unpack_relays, payload))
+            self._finish_cmd()
+        else:
+            raise Exception(f"unknown frame type: {frame_type}")
+
+    def _begin_cmd(self):
+        self.cmd_started_ns = time.perf_counter_ns()
+        self.ss.metrics.cmds += 1
+        self.relays = []
+        self.pulls = defaultdict(set)   # node ID -> IDs of the messages whose bodies are to be pulled from it
+
+    def _finish_cmd(self):
+        # the relays of messages whose bodies are still to be pulled wait for them, so that the peers they go to can
+        # pull the bodies from this node in turn; the other relays go out right away
+        if self.pulls:
+            pulled_ids = set().union(*self.pulls.values())
+            held_relays = [(p, relay) for p, relay in self.relays if relay[1] in pulled_ids]
+            self.relays = [(p, relay) for p, relay in self.relays if relay[1] not in pulled_ids]
+            self._pull_bodies(self.pulls, held_relays)
+        if self.relays:
+            self._send_relays(self.relays)
+        self.ss.metrics.handle.observe_since(self.cmd_started_ns)
+
+    def _parse(self, parse, data):
+        started_ns = time.perf_counter_ns()
+        parsed = parse(data)
+        self.ss.metrics.parse.observe_since(started_ns)
+        return parsed
+
+    def _write_response(self, data: bytes):
+        raise NotImplementedError
+
+    def _send_relays(self, relays):
+        """Send each (peer, (relay_limit, msg_id, node_path, body, dissemination)) pair produced while processing the current command."""
+        raise NotImplementedError
+
+    def _pull_bodies(self, pulls, relays):
+        """Pull the bodies of messages from the nodes that relayed them by ID alone, then send the relays of them."""
+        self._fetch_bodies(pulls)
+        self._send_pulled_relays(relays)
+
+    def _send_pulled_relays(self, relays):
+        # the relays of messages whose body didn't come are dropped: their peers would find no body to pull here;
+        # they can still get the message from another peer, or from an anti-entropy round
+        pulled_relays = [(p, relay) for p, relay in relays if self._has_body(relay[1])]
+        self.ss.metrics.relays_unpulled += len(relays) - len(pulled_relays)
+        if pulled_relays:
+            self._send_relays(pulled_relays)
+
+    def _has_body(self, msg_id):
+        msg_attrs = self.ss.msgs_box.get_loaded(msg_id)
+        return msg_attrs is not None and msg_attrs.content is not None
+
+    def _stop_server(self):
+        """Stop serving, e.g. to remove this node from a worker process that hosts other nodes too."""
+        raise NotImplementedError
+
+    def _stream_response(self, chunks):
+        """Write a response out chunk by chunk, as it's generated."""
+        for chunk in chunks:
+            self._write_response(chunk)
+
+    def _get_transport_stats(self):
+        """Counters of the engine's relaying to peers, to report along with the processor's own."""
+        return {}
 
     def _get_cmd_handler(self):
         return {
             "/NEW":    self._proc_new_msg,
             "/RELAY":  self._proc_relayed_msg,
+            "/RELAYS": self._proc_relayed_batch,
             "/GET":    self._send_client_msgs_data,
             "/PEERS":  self._get_peers_info,
+            "/INFO":   self._get_node_info,
+            "/ADD":    self._add_peer,
             "/REMOVE": self._remove_peer,
+            "/HEARTBEAT": self._answer_heartbeat,
+            "/QUEUES": self._get_queues_stats,
+            "/STORE":  self._get_store_stats,
+            "/SYNC":   self._sync_digests,
+            "/PUSH":   self._ingest_pushed_msgs,
+            "/PULL":   self._send_msg_bodies,
+            "/TIMES":  self._get_reception_times,
+            "/RUSAGE": self._get_rusage,
+            "/STATS":  self._get_node_stats,
+            "/SHUTDOWN": self._stop_server,
         }[self.cmd]
 
     def _proc_new_msg(self):
         self._set_relay_limit_and_msg_text_on_send()
-        self.msg_id = f"{self.msg_content}_{time.time_ns()}"    # TODO: hash this value to create a constant length value
-        self.curr_msg_attrs = self.server.ss.msgs_box[self.msg_id] = self._init_new_msg_attrs()
-        self.node_path = [self.server.ss.node_id]
-        self._save_path_and_relay()
+        origin_ts = self._now_ns()
+        self.msg_id = GossipCommandProcessor._hash_msg_id(self.msg_content, self.ss.node_id, origin_ts)
+        with self.ss.msgs_box.lock_for(self.msg_id):
+            self.curr_msg_attrs = self.ss.msgs_box[self.msg_id] = self._init_new_msg_attrs()
+            self.curr_msg_attrs.content, self.curr_msg_attrs.origin_ts = self.msg_content, origin_ts
+            self.curr_msg_attrs.dissemination = self.msg_dissemination or self.ss.dissemination
+            self.node_path = [self.ss.node_id]
+            self._save_path_and_relay()
 
     def _proc_relayed_msg(self):
         self._set_relay_limit_and_msg_text_on_send()
-        self.msg_id, self.node_path = json.loads(self.msg_content)
-        pn = self.prev_node = self.node_path[-1]
+        self.msg_id, self.node_path, *extras = self._parse(json.loads, self.msg_content)
+        self.msg_body = extras[0] if extras else None
+        self.msg_dissemination = Dissemination.from_wire(extras[1] if len(extras) > 1 else None)
+        self._proc_relay()
 
-        if self.msg_id in self.server.ss.msgs_box:
-            self.curr_msg_attrs = self.server.ss.msgs_box[self.msg_id]
-        else:
-            self.curr_msg_attrs = self.server.ss.msgs_box[self.msg_id] = self._init_new_msg_attrs()
+    def _proc_relayed_batch(self):
+        self._proc_relays(self._parse(json.loads, self.msg_data))
 
-        self.curr_msg_attrs["in_counts"][pn] += 1
-        within_receive_limit = self.curr_msg_attrs["in_counts"][pn] <= self.relay_limit
-        is_first_reception   = self.msg_id not in self.server.ss.msgs_box
+    def _proc_relays(self, relays):
+        # a batch holds many relays from the same peer, all processed in this one pass over the msgs_box
+        for self.relay_limit, self.msg_id, self.node_path, self.msg_body, dissemination_data in relays:
+            self.msg_dissemination = Dissemination.from_wire(dissemination_data)
+            self._proc_relay()
 
-        if within_receive_limit or is_first_reception:
-            self.node_path.append(self.server.ss.node_id)
-            self._save_path_and_relay()
+    def _proc_relay(self):
+        pn = self.prev_node = self.node_path[-1]
+        self.ss.metrics.relays_in += 1
+        if self.ss.msgs_box.is_evicted(self.msg_id):
+            return
+
+        # the record is updated atomically from the reception check on, so that no two handlers can both take
+        # a relay for the message's first reception, nor lose each other's counts
+        with self.ss.msgs_box.lock_for(self.msg_id):
+            self.curr_msg_attrs, is_first_reception = self.ss.msgs_box.get_or_create(self.msg_id, self._init_new_msg_attrs)
+            if is_first_reception:
+                self.ss.metrics.first_receptions += 1
+                self.curr_msg_attrs.dissemination = self.msg_dissemination
+            else:
+                self.ss.metrics.duplicates += 1
+            if self.msg_body is not None and self.curr_msg_attrs.content is None:
+                self.curr_msg_attrs.set_body(*self.msg_body, self._now_ns())
+            elif self.curr_msg_attrs.content is None:
+                self.pulls[pn].add(self.msg_id)
+
+            within_receive_limit = self.curr_msg_attrs.count_in(self.ss.get_peer_slot(pn)) <= self.relay_limit
+
+            if within_receive_limit or is_first_reception:
+                self.node_path.append(self.ss.node_id)
+                self._save_path_and_relay()
+            else:
+                self.ss.metrics.duplicates_suppressed += 1
+                self.ss.msgs_box.mark_updated(self.msg_id)  # its in count still went up
 
     def _send_client_msgs_data(self):
-        status_type, paths_type = self.msg_data.split("|")
+        # "<status>|<paths>[|<since>|<after>|<limit>]": a page of the messages sent at or after the `since` origin
+        # timestamp, and coming after the `after` message ID, in (origin_ts, msg_id) order
+        status_type, paths_type, *page_args = self.msg_data.split("|")
+        since, after, limit = page_args if page_args else ("", "", "")
 
         # TODO: refactor below using structural pattern matching
         assert status_type in {"unread", "read", "all"}
@@ -99,70 +360,241 @@ class GossipMessageHandler(StreamRequestHandler):
             "all":    (True, False),
         }[status_type]
 
-        msgs_data = {msg_id: GossipMessageHandler._filter_in_paths(msg_attrs["in_paths"], paths_type) for msg_id, msg_attrs
-            in self.server.ss.msgs_box.items() if msg_attrs["is_unread"] in status_type_filter}
-        self.wfile.write(bytes(json.dumps(msgs_data), "utf-8"))
-        self._mark_msgs_as_read_on_get(status_type)
+        # messages whose body hasn't arrived yet (only their ID has) are held back until it does
+        cursor = (int(since) if since else 0, after)
+        page_keys = [(msg_attrs.origin_ts, msg_id) for msg_id, msg_attrs in list(self.ss.msgs_box.items())
+            if msg_attrs.is_unread in status_type_filter and msg_attrs.content is not None
+            and (msg_attrs.origin_ts, msg_id) > cursor]
+        if limit and len(page_keys) > int(limit):
+            page_keys, has_more = heapq.nsmallest(int(limit), page_keys), True
+        else:
+            page_keys, has_more = sorted(page_keys), False
+        self._stream_response(self._iter_msgs_lines(page_keys, paths_type, status_type, has_more))
+
+    def _iter_msgs_lines(self, page_keys, paths_type, status_type, has_more):
+        """The newline-delimited JSON /GET response: a [msg_id, content, origin_ts, paths] line per message, then a
+        {"next": cursor} line, whose cursor is the [since, after] of the next page (or null after the last page)."""
+        for origin_ts, msg_id in page_keys:
+            msg_attrs = self.ss.msgs_box[msg_id] if msg_id in self.ss.msgs_box else None
+            if msg_attrs is None:   # evicted since the page was picked
+                continue
+            paths = GossipCommandProcessor._filter_in_paths(msg_attrs.in_paths, paths_type)
+            yield bytes(json.dumps([msg_id, msg_attrs.content, origin_ts, paths]) + "\n", "utf-8")
+            if status_type in {"unread", "all"} and msg_attrs.is_unread:
+                msg_attrs.is_unread = False
+                self.ss.msgs_box.mark_updated(msg_id)
+        next_cursor = list(page_keys[-1]) if has_more else None
+        yield bytes(json.dumps({"next": next_cursor}) + "\n", "utf-8")
 
     def _get_peers_info(self):
-        peers_info = [(p.id, f"{p.node_name} ({p.address})") for p in self.server.ss.peers]
-        self.wfile.write(bytes(json.dumps(peers_info), "utf-8"))
+        peers_info = [(p.id, f"{p.node_name} ({p.address})") for p in self.ss.peers]
+        self._write_response(bytes(json.dumps(peers_info), "utf-8"))
+
+    def _get_node_info(self):
+        node_info = {
+            "node_id":      self.ss.node_id,
+            "address":      f"{self.ss.hostname}:{self.ss.port}",
+            "pid":          os.getpid(),
+            "ports_origin": PORTS_ORIGIN,
+            "peers":        [[p.id, p.address] for p in self.ss.peers],
+        }
+        self._write_response(bytes(json.dumps(node_info), "utf-8"))
+
+    def _add_peer(self):
+        self.ss.add_peer(int(self.msg_data))
 
     def _remove_peer(self):
-        peer_id   = int(self.msg_data)
-        peer_port = str(PORTS_ORIGIN + peer_id)
-        self.server.ss.peers = [p for p in self.server.ss.peers if p.id != peer_id]
-        self.server.ss.peer_addrs = [paddr for paddr in self.server.ss.peer_addrs if peer_port not in paddr]
+        self.ss.remove_peer(int(self.msg_data))
+
+    def _answer_heartbeat(self):
+        self._write_response(bytes(json.dumps(mb.answer_heartbeat(self.ss, int(self.msg_data))), "utf-8"))
+
+    def _get_queues_stats(self):
+        queues_stats = {peer_id: q.get_stats() for peer_id, q in list(self.ss.outbound.items())}
+        self._write_response(bytes(json.dumps(queues_stats), "utf-8"))
+
+    def _get_store_stats(self):
+        store_stats = self.ss.msgs_box.get_stats()
+        if self.ss.anti_entropy is not None:
+            store_stats["anti_entropy"] = self.ss.anti_entropy.get_stats()
+        if self.ss.msg_log is not None:
+            store_stats["wal"] = self.ss.msg_log.get_stats()
+        self._write_response(bytes(json.dumps(store_stats), "utf-8"))
+
+    def _get_reception_times(self):
+        reception_times = {msg_id: [msg_attrs.origin_ts, msg_attrs.received_ns, msg_attrs.get_total_out()]
+            for msg_id, msg_attrs in list(self.ss.msgs_box.items()) if msg_attrs.content is not None}
+        self._write_response(bytes(json.dumps(reception_times), "utf-8"))
+
+    def _get_rusage(self):
+        ru = resource.getrusage(resource.RUSAGE_SELF)
+        rusage = {"cpu_user": ru.ru_utime, "cpu_sys": ru.ru_stime, "max_rss_kb": ru.ru_maxrss}
+        self._write_response(bytes(json.dumps(rusage), "utf-8"))
+
+    def _get_node_stats(self):
+        node_stats = self.ss.metrics.to_dict()
+        node_stats["gauges"] = {
+            "peers":         len(self.ss.peers),
+            "store_entries": len(self.ss.msgs_box),
+        }
+        if (store_bytes := self.ss.msgs_box.get_stats().get("bytes")) is not None:
+            node_stats["gauges"]["store_bytes"] = store_bytes
+        # the threads are the process', which may host other nodes too (see start_network.start_workers)
+        node_stats["process"] = {"pid": os.getpid(), "threads": threading.active_count()}
+        node_stats["transport"] = self._get_transport_stats()
+        if self.ss.membership is not None:
+            node_stats["membership"] = self.ss.membership.get_stats()
+        self._write_response(bytes(json.dumps(node_stats), "utf-8"))
+
+    def _sync_digests(self):
+        missing_msgs = ae.collect_missing(self.ss, ae.decode_digest(self.msg_data))
+        digest_str = ae.encode_digest(ae.build_digest(self.ss))
+        self._write_response(bytes(json.dumps([digest_str, missing_msgs]), "utf-8"))
+
+    def _ingest_pushed_msgs(self):
+        ae.ingest_missing(self.ss, json.loads(self.msg_data))
+
+    def _send_msg_bodies(self):
+        msg_bodies = {}
+        for msg_id in json.loads(self.msg_data):
+            if msg_id in self.ss.msgs_box and self.ss.msgs_box[msg_id].content is not None:
+                msg_attrs = self.ss.msgs_box[msg_id]
+                msg_bodies[msg_id] = [msg_attrs.content, msg_attrs.origin_ts]
+        # newline-terminated, as it's read off a pooled connection that stays open (see PeerConnectionPool.request)
+        self._write_response(bytes(json.dumps(msg_bodies) + "\n", "utf-8"))
+
+    def _fetch_bodies(self, pulls):
+        for node_id, msg_ids in pulls.items():
+            try:
+                msg_bodies = GossipClient(self.ss.get_node_addr(node_id), pool=self.ss.pool).pull_msg_bodies(list(msg_ids))
+            except (OSError, ValueError):   # unreachable, or closed the connection without a full answer
+                continue    # the bodies can still come with a later relay, or an anti-entropy round
+            for msg_id, (content, origin_ts) in msg_bodies.items():
+                with self.ss.msgs_box.lock_for(msg_id):
+                    msg_attrs = self.ss.msgs_box[msg_id] if msg_id in self.ss.msgs_box else None
+                    if msg_attrs is not None and msg_attrs.content is None:
+                        msg_attrs.set_body(content, origin_ts, self._now_ns())
+                        self.ss.msgs_box.touch(msg_id)
 
     def _set_relay_limit_and_msg_text_on_send(self):
+        # the relay limit may be followed by the message's dissemination: "<relay_limit>[,<strategy>,<fanout>,<max_hops>]"
         rl_str, self.msg_content = self.msg_data.split("|", maxsplit=1)
+        rl_str, *dissemination_data = rl_str.split(",")
         self.relay_limit = int(rl_str)
+        self.msg_dissemination = None
+        if dissemination_data:
+            strategy, fanout, max_hops = dissemination_data
+            self.msg_dissemination = Dissemination(strategy, int(fanout), int(max_hops))
 
     def _init_new_msg_attrs(self):
-        return {
-            "in_paths":   [],
-            "in_counts":  Counter({p.id: 0 for p in self.server.ss.peers}),
-            "out_counts": Counter({p.id: 0 for p in self.server.ss.peers}),
-            "is_unread":  True,
-        }
+        return MessageRecord(len(self.ss.peer_slots), self._now_ns())
 
     def _save_path_and_relay(self):
-        self.curr_msg_attrs["in_paths"].append(self.node_path)
-        self._relay_to_peers((self.msg_id, self.node_path))
-
-    def _relay_to_peers(self, data):
-        for p in self._get_peers_to_relay():
-            if self.curr_msg_attrs["out_counts"][p.id] < self.relay_limit:
-                p.send_message(json.dumps(data), is_relay=True, relay_limit=self.relay_limit)
-                self.curr_msg_attrs["out_counts"][p.id] += 1
+        self.curr_msg_attrs.add_path(self.node_path)
+        self.ss.msgs_box.touch(self.msg_id)
+        self._relay_to_peers()
+
+    def _relay_to_peers(self):
+        dissemination = self.curr_msg_attrs.dissemination
+        if not dissemination.allows_relay(self.node_path):
+            return
+        body = [self.curr_msg_attrs.content, self.curr_msg_attrs.origin_ts]
+        dissemination_data = dissemination.to_wire()
+        for p in dissemination.select_peers(self._get_peers_to_relay(), self.rng):
+            slot = self.ss.get_peer_slot(p.id)
+            out_count = self.curr_msg_attrs.get_out_count(slot)
+            if out_count < self.relay_limit:
+                # the body only goes out with the first relay to each peer, and never when lazy;
+                # later relays reference it by ID alone
+                send_body = out_count == 0 and body[0] is not None and not dissemination.is_lazy
+                relay = (self.relay_limit, self.msg_id, self.node_path, body if send_body else None, dissemination_data)
+                self.relays.append((p, relay))
+                self.curr_msg_attrs.count_out(slot)
+                self.ss.metrics.relays_out += 1
 
     def _get_peers_to_relay(self):
         if self.cmd == "/NEW":
-            return self.server.ss.peers
-        elif self.cmd == "/RELAY":
+            return self.ss.peers
+        elif self.cmd in {"/RELAY", "/RELAYS"}:
             # filter out the preceeding node which relayed the current message to this node
-            return [p for p in self.server.ss.peers if p.id != self.prev_node]
+            return [p for p in self.ss.peers if p.id != self.prev_node]
         else:
             raise Exception("this should never be reached!")
 
-    def _mark_msgs_as_read_on_get(self, status_type):
-        if status_type in {"unread", "all"}:
-            for msg_attrs in self.server.ss.msgs_box.values():
-                msg_attrs["is_unread"] = False
+    def _now_ns(self):
+        return time.time_ns()
+
+    @staticmethod
+    def _hash_msg_id(msg_content, origin_node_id, origin_ts):
+        """A fixed-width, content-addressed message ID: 16-byte digest, as 32 hex characters."""
+        digest = hashlib.blake2b(f"{origin_node_id}|{origin_ts}|{msg_content}".encode(), digest_size=MSG_ID_SIZE)
+        return digest.hexdigest()
 
     @staticmethod
-    def _filter_in_paths(in_paths_ls, paths_type):
+    def _filter_in_paths(in_paths, paths_type):
         assert paths_type in {"shortest & longest", "longest", "shortest", "all"}
 
         if paths_type == "all":
-            return in_paths_ls
+            return list(in_paths)
 
         filtered_paths_ls = []
         if "shortest" in paths_type:
-            min_hops = min(len(ps) for ps in in_paths_ls)
-            filtered_paths_ls += [pl for pl in in_paths_ls if len(pl) == min_hops]
+            filtered_paths_ls += in_paths.get_shortest()
         if "longest" in paths_type:
-            max_hops = max(len(ps) for ps in in_paths_ls)
-            filtered_paths_ls += [pl for pl in in_paths_ls if len(pl) == max_hops]
+            filtered_paths_ls += in_paths.get_longest()
 
         return filtered_paths_ls
+
+
+class GossipMessageHandler(GossipCommandProcessor, StreamRequestHandler):
+
+    def setup(self):
+        super().setup()
+        self.ss = self.server.ss
+
+    def handle(self):
+        # each connection carries a stream of newline-framed commands; pooled peer connections send many of them
+        for raw_line in self.rfile:
+            line = raw_line.strip()
+            if not line:
+                continue
+            if line == wire.PROTO_BINARY_REQUEST.strip():
+                self._write_response(wire.PROTO_BINARY_ACK)
+                self._handle_binary()
+                return
+            self._proc_cmd_line(line.decode(), len(raw_line))
+            self.wfile.flush()
+
+    def _handle_binary(self):
+        while (frame := wire.read_frame(self.rfile)) is not None:
+            self._proc_frame(*frame)
+
+    def _write_response(self, data):
+        self.ss.metrics.bytes_out += len(data)
+        self.wfile.write(data)
+
+    def _send_relays(self, relays):
+        # hand off to the per-peer queues, so neither this handler nor the other peers wait on a slow peer
+        started_ns = time.perf_counter_ns()
+        for p, relay in relays:
+            if (q := self.ss.get_outbound_queue(p)) is not None:
+                q.put(relay)
+        self.ss.metrics.fanout.observe_since(started_ns)
+
+    def _pull_bodies(self, pulls, relays):
+        # on the puller's threads, so that this handler goes on to its next command without waiting on the round trips
+        if not self.ss.puller.put(partial(GossipCommandProcessor._pull_bodies, self, pulls, relays)):
+            self.ss.metrics.relays_unpulled += len(relays)
+
+    def _stop_server(self):
+        # shutdown() waits for serve_forever() to return, which it only does once this handler is done
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    def _get_transport_stats(self):
+        queues = list(self.ss.outbound.values())
+        return {
+            "relay_bytes_out": self.ss.pool.bytes_sent,
+            "relay_failures":  sum(q.failed for q in queues),
+            "relays_dropped":  sum(q.dropped for q in queues),
+            "outbound_depth":  sum(q.get_stats()["depth"] for q in queues),
+        }
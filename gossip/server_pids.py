@@ -1,7 +1,8 @@
-import json
+import os, json
 
 
-# .server_pids.json is used by cli.py to stop the network & remove nodes
+# .server_pids.json is used by cli.py to stop the network & remove nodes; it maps each node ID to the pid of its
+# process, or when nodes are hosted by worker processes, "workers" to a map of each worker's pid to its node IDs
 SRV_PIDS_FILE = ".srv_pids.json"
 
 
@@ -13,3 +14,27 @@ def write_pids_map_to_file(pids_map):
 def read_server_pids_to_map():
     with open(SRV_PIDS_FILE) as f:
         return json.loads(f.read())
+
+
+def get_node_ids(pids_map):
+    node_ids = [key for key in pids_map if key.isdigit()]
+    return node_ids + [str(node_id) for node_ids in pids_map.get("workers", {}).values() for node_id in node_ids]
+
+
+def get_pids(pids_map):
+    """The pids of the processes hosting nodes: one per node, or the workers."""
+    return [pid for key, pid in pids_map.items() if key.isdigit()] + [int(pid) for pid in pids_map.get("workers", {})]
+
+
+def is_running(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"   # exited, but not reaped by its parent yet
+    except FileNotFoundError:
+        return False
+    except OSError:     # no /proc: fall back on signal 0, which still counts zombies as running
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        return True
@@ -0,0 +1,274 @@
+"""A deterministic, in-process, discrete-event simulation of a gossip network.
+
+Every node of a GossipNetwork topology becomes a virtual node, which is nothing but its ServerSettings (msgs_box,
+peers & their slots); the relays between them are processed by the very same GossipCommandProcessor the servers run.
+Relays travel as events on a single simulated clock, over links with a configurable latency, jitter & loss, and all
+randomness is drawn from a single seed, so that every run with the same parameters has the same outcome.
+
+Nodes can also be failed at once, for each survivor's Membership to detect & repair the topology in rounds of
+heartbeats, which are exchanged between the nodes' settings directly, off the simulated clock.
+"""
+
+import heapq, itertools, random, threading
+from collections import namedtuple, defaultdict
+import networkx as nx
+
+from gossip.server import ServerSettings, GossipCommandProcessor
+from gossip.msg_store import new_msg_store
+from gossip.membership import Membership, answer_heartbeat
+from gossip.metrics import NodeMetrics
+from gossip.start_network import build_network, get_peer_addrs
+from gossip.constants import LOCALHOST, PORTS_ORIGIN, MEMBERSHIP_SUSPECT_AFTER
+
+
+SimPeer = namedtuple("SimPeer", ["id", "address"])
+
+
+class SimNodeSettings(ServerSettings):
+    """The settings of a virtual node: the same msgs_box & peer bookkeeping as a server's, minus its sockets & threads."""
+
+    def __post_init__(self):
+        self.node_id = int(self.port) - PORTS_ORIGIN
+        self.msgs_box = new_msg_store(self.store_max_entries, self.store_max_bytes, self.store_ttl)
+        self.peers = [self._new_peer(addr) for addr in self.peer_addrs]
+        self.peer_slots = {p.id: slot for slot, p in enumerate(self.peers)}
+        self.peer_slots_lock, self.peers_lock = threading.Lock(), threading.Lock()
+        self.pool, self.outbound, self.anti_entropy, self.msg_log, self.membership = None, {}, None, None, None
+        self.metrics = None     # set by the simulator to its own, shared by all of its nodes
+
+    def _new_peer(self, addr):
+        return SimPeer(int(addr.rsplit(":", 1)[1]) - PORTS_ORIGIN, addr)
+
+
+class SimMembership(Membership):
+    """A virtual node's Membership, whose heartbeats & attachments reach the other nodes' settings directly."""
+
+    def __init__(self, sim, ss, placement, target_degree=None):
+        super().__init__(ss, None, placement, target_degree, sim.rng)
+        self.sim = sim
+
+    def _heartbeat(self, peer):
+        if peer.id not in self.sim.nodes or self.sim._is_lost():
+            raise OSError(f"no answer from {peer.id}")
+        return answer_heartbeat(self.sim.nodes[peer.id], self.ss.node_id)
+
+    def _attach(self, node_id):
+        if node_id not in self.sim.nodes:
+            raise OSError(f"no answer from {node_id}")
+        self.sim.nodes[node_id].add_peer(self.ss.node_id)
+
+
+class GossipSimulator(GossipCommandProcessor):
+    """Runs every node of a network on one simulated clock.
+
+    A single processor serves all the nodes: everything that outlives a command is kept in the node's settings,
+    so `self.ss` is just switched to whichever node handles the current event.
+    """
+
+    def __init__(self, network, seed=None, latency=0.01, jitter=0.0, loss=0.0, **settings_opts):
+        self.network = network
+        self.rng = random.Random(seed)
+        self.latency = latency  # seconds each frame takes to reach the peer it's sent to
+        self.jitter = jitter    # max extra seconds, picked uniformly at random, added to each frame's latency
+        self.loss = loss        # probability of each frame (or body pull) being lost
+        self.metrics = NodeMetrics()
+        self.nodes = {node_id: self._new_node_settings(node_id, settings_opts) for node_id in network.G.nodes}
+        self.now = 0.0
+        self.reception_times = {}   # msg ID -> {node ID: simulated time at which the node got the message's body}
+        self.stats = {"relays": 0, "frames": 0, "lost": 0, "pulls": 0}
+        self._events = []           # heap of (time, seq, node ID, relays) frame deliveries
+        self._seq = itertools.count()
+
+    def inject(self, node_id, content, relay_limit=1):
+        """Send a new message to a node at the current simulated time; returns the message's ID."""
+        self._proc_event(node_id, lambda: self._proc_cmd_line(f"/NEW:{relay_limit}|{content}"))
+        self.reception_times[self.msg_id] = {node_id: self.now}
+        return self.msg_id
+
+    def send_msgs(self, num_msgs, relay_limit=1):
+        """Inject num_msgs messages into random nodes, and run until they're done spreading; returns their IDs."""
+        node_ids = sorted(self.nodes)
+        msg_ids = [self.inject(self.rng.choice(node_ids), f"sim-msg-{len(self.reception_times)}", relay_limit)
+                   for _ in range(num_msgs)]
+        self.run()
+        return msg_ids
+
+    def enable_membership(self, placement=None, target_degree=None):
+        """Give every node a Membership, and have it hear of other nodes through the first rounds of heartbeats."""
+        for node_ss in self.nodes.values():
+            node_ss.membership = SimMembership(self, node_ss, placement, target_degree)
+        self.run_membership_rounds(MEMBERSHIP_SUSPECT_AFTER)
+
+    def fail_nodes(self, node_ids):
+        """Make the nodes fail at once: they're gone from the network, but not from their peers' lists."""
+        for node_id in node_ids:
+            del self.nodes[node_id]
+
+    def run_membership_rounds(self, max_rounds):
+        """Run heartbeat rounds on every node until the topology is stable; returns the number of rounds run."""
+        for num_rounds in range(1, max_rounds + 1):
+            changes = self._count_membership_changes()
+            for node_id in sorted(self.nodes):
+                self.nodes[node_id].membership.run_round()
+            # a dead peer is only removed after missing MEMBERSHIP_SUSPECT_AFTER heartbeats in a row
+            if num_rounds >= MEMBERSHIP_SUSPECT_AFTER and self._count_membership_changes() == changes:
+                return num_rounds
+        return max_rounds
+
+    def get_topology(self):
+        """The connectivity of the live nodes, through the peers each of them still has."""
+        G = nx.Graph()
+        G.add_nodes_from(self.nodes)
+        G.add_edges_from((node_id, p.id) for node_id, node_ss in self.nodes.items() for p in node_ss.peers
+                         if p.id in self.nodes)
+        degrees = [d for _, d in G.degree]
+        return {
+            "components": nx.number_connected_components(G),
+            "isolated":   sum(d == 0 for d in degrees),
+            "degree":     (min(degrees), sum(degrees) / len(degrees), max(degrees)),
+        }
+
+    def run(self, until=None):
+        """Process the pending events in time order, until none are left or the clock would go past `until`."""
+        while self._events and (until is None or self._events[0][0] <= until):
+            self.now, _, node_id, relays = heapq.heappop(self._events)
+            self._proc_event(node_id, lambda: self._proc_frame_relays(relays))
+            self._record_receptions(node_id, relays)
+        if until is not None:
+            self.now = max(self.now, until)
+
+    def get_msg_report(self, msg_id):
+        times = sorted(self.reception_times[msg_id].values())
+        return {
+            "reached":     len(times),
+            "coverage":    len(times) / len(self.nodes),
+            "convergence": times[-1] - times[0],
+            "p50":         percentile(times, 50) - times[0],
+            "p95":         percentile(times, 95) - times[0],
+        }
+
+    def get_report(self, msg_ids=None):
+        msg_reports = [self.get_msg_report(msg_id) for msg_id in (self.reception_times if msg_ids is None else msg_ids)]
+        num_msgs = len(msg_reports) or 1
+        return {
+            "nodes":           len(self.nodes),
+            "msgs":            len(msg_reports),
+            "coverage":        sum(mr["coverage"] for mr in msg_reports) / num_msgs,
+            "fully_converged": sum(mr["reached"] == len(self.nodes) for mr in msg_reports),
+            "convergence":     max((mr["convergence"] for mr in msg_reports), default=0.0),
+            "p50":             percentile(sorted(mr["p50"] for mr in msg_reports), 50),
+            "p95":             percentile(sorted(mr["p95"] for mr in msg_reports), 95),
+            "relays_per_msg":  self.stats["relays"] / num_msgs,
+            **self.stats,
+        }
+
+    def _new_node_settings(self, node_id, settings_opts):
+        peer_addrs = get_peer_addrs(self.network.get_peers_for_node(node_id))
+        node_ss = SimNodeSettings(LOCALHOST, PORTS_ORIGIN + node_id, peer_addrs, **settings_opts)
+        node_ss.metrics = self.metrics
+        return node_ss
+
+    def _count_membership_changes(self):
+        return sum(node_ss.membership.removed + node_ss.membership.attached for node_ss in self.nodes.values())
+
+    def _proc_event(self, node_id, proc_cmd):
+        self.ss = self.nodes[node_id]
+        self.send_delay = 0.0   # relays only leave once the bodies they need are pulled in
+        proc_cmd()
+
+    def _proc_frame_relays(self, relays):
+        self.cmd = "/RELAYS"
+        self._begin_cmd()
+        self._proc_relays(relays)
+        self._finish_cmd()
+
+    def _record_receptions(self, node_id, relays):
+        for _, msg_id, *_ in relays:
+            msg_times = self.reception_times.get(msg_id)
+            if msg_times is None or node_id in msg_times:
+                continue
+            if msg_id in self.ss.msgs_box and self.ss.msgs_box[msg_id].content is not None:
+                msg_times[node_id] = self.now
+
+    def _write_response(self, data):
+        pass    # there are no clients in a simulation, only relays between nodes
+
+    def _send_relays(self, relays):
+        peer_relays = defaultdict(list)
+        for p, (relay_limit, msg_id, node_path, body, dissemination) in relays:
+            # each peer gets its own copy of the path, as it's extended in place by whoever processes it
+            peer_relays[p.id].append((relay_limit, msg_id, list(node_path), body, dissemination))
+        for peer_id, prs in peer_relays.items():
+            self.stats["frames"] += 1
+            self.stats["relays"] += len(prs)
+            if peer_id not in self.nodes or self._is_lost():
+                self.stats["lost"] += 1
+                continue
+            heapq.heappush(self._events, (self.now + self.send_delay + self._link_delay(), next(self._seq), peer_id, prs))
+
+    def _pull_bodies(self, pulls, relays):
+        # like the servers' _fetch_bodies: one round trip to each node in turn, before the relays waiting on them go out
+        for node_id, msg_ids in pulls.items():
+            self.stats["pulls"] += 1
+            self.send_delay += self._link_delay() + self._link_delay()
+            if node_id not in self.nodes or self._is_lost():
+                continue
+            src_msgs_box = self.nodes[node_id].msgs_box
+            for msg_id in msg_ids:
+                if msg_id not in src_msgs_box or src_msgs_box[msg_id].content is None:
+                    continue
+                msg_attrs = self.ss.msgs_box[msg_id]
+                if msg_attrs.content is None:
+                    msg_attrs.set_body(src_msgs_box[msg_id].content, src_msgs_box[msg_id].origin_ts,
+                                       self._now_ns() + int(self.send_delay * 1e9))
+        self._send_pulled_relays(relays)
+        self.send_delay = 0.0   # the command's other relays don't wait on the pulls
+
+    def _now_ns(self):
+        return int(self.now * 1e9)
+
+    def _link_delay(self):
+        return self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def _is_lost(self):
+        return self.loss > 0 and self.rng.random() < self.loss
+
+
+def percentile(sorted_values, pct):
+    """The nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-pct * len(sorted_values) // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def simulate(network_type, num_nodes, extra_graph_params=None, seed=None, num_msgs=1, relay_limit=1,
+             latency=0.01, jitter=0.0, loss=0.0, settings_opts=None):
+    """Build a seeded network, send num_msgs messages to random nodes of it, and report how they spread."""
+    network = build_network(network_type, num_nodes, extra_graph_params, seed)
+    sim = GossipSimulator(network, seed, latency, jitter, loss, **(settings_opts or {}))
+    sim.send_msgs(num_msgs, relay_limit)
+    return sim.get_report()
+
+
+def simulate_churn(network_type, num_nodes, extra_graph_params=None, seed=None, num_msgs=1, relay_limit=1,
+                   latency=0.01, jitter=0.0, loss=0.0, churn=0.1, repair=True, max_rounds=100, settings_opts=None):
+    """Send num_msgs messages over a seeded network, fail a random `churn` fraction of its nodes at once, let the
+    survivors repair the topology (unless repair is False), then send num_msgs more; reports how both sets spread."""
+    network = build_network(network_type, num_nodes, extra_graph_params, seed)
+    sim = GossipSimulator(network, seed, latency, jitter, loss, **(settings_opts or {}))
+    sim.enable_membership(network_type)
+    before = sim.get_report(sim.send_msgs(num_msgs, relay_limit))
+    topology_before = sim.get_topology()
+
+    sim.stats = dict.fromkeys(sim.stats, 0)     # the relays & frames of each set of messages are reported apart
+    failed = sim.rng.sample(sorted(sim.nodes), int(churn * len(sim.nodes)))
+    sim.fail_nodes(failed)
+    num_rounds = sim.run_membership_rounds(max_rounds) if repair else 0
+    after = sim.get_report(sim.send_msgs(num_msgs, relay_limit))
+    return {
+        "failed":          len(failed),
+        "repair_rounds":   num_rounds,
+        "before":          {**before, "topology": topology_before},
+        "after":           {**after, "topology": sim.get_topology()},
+    }
@@ -1,8 +1,9 @@
-import sys
+import os, sys, time, queue, asyncio
 import multiprocessing as mp
 
 import gossip.server_pids as sp
 from gossip.server import GossipServer
+from gossip.aio_server import AsyncGossipServer, serve_many
 from gossip.network import *
 from gossip.constants import *
 
@@ -13,14 +14,25 @@ def get_peer_addrs(peer_ids):
     return [gn_addr(p) for p in peer_ids]
 
 
-def start_server(network_graph, node_id):
-    peer_ids = network_graph.get_peers_for_node(node_id)
+def start_server(network_graph, node_id, engine="threading", settings_opts=None):
+    start_node(node_id, network_graph.get_peers_for_node(node_id), engine, settings_opts)
+
+
+def start_node(node_id, peer_ids, engine="threading", settings_opts=None):
     peer_addrs = get_peer_addrs(peer_ids)
 
-    server = GossipServer(gn_addr(node_id), peer_addrs)
+    ServerCls = get_server_cls(engine)
+    server = ServerCls(gn_addr(node_id), peer_addrs, **(settings_opts or {}))
     server.start()
 
 
+def get_server_cls(engine):
+    return {
+        "threading": GossipServer,
+        "asyncio":   AsyncGossipServer,
+    }[engine]
+
+
 def get_network(network_type, num_nodes, extra_graph_params):
     random_k_deg = extra_graph_params.pop("random_k_deg")
     if network_type == "random":
@@ -34,6 +46,13 @@ def get_network(network_type, num_nodes, extra_graph_params):
     }[network_type]
 
 
+def build_network(network_type, num_nodes, extra_graph_params=None, seed=None):
+    if extra_graph_params is None:  # TODO: can remove this check after adding type hints
+        extra_graph_params = {"random_k_deg": None}
+    NetworkCls, ncls_args = get_network(network_type, num_nodes, extra_graph_params)
+    return NetworkCls(*ncls_args, seed=seed)
+
+
 def plot_network(network, pids_map):    # plt.show() in separate process as to not block servers
     plt_proc = mp.Process(target=network.show_graph, args=())
     plt_proc.start()
@@ -41,21 +60,78 @@ def plot_network(network, pids_map):    # plt.show() in separate process as to n
     return plt_proc
 
 
-def start_network(network_type, num_nodes, extra_graph_params=None, plot=False):
-    if extra_graph_params is None:  # TODO: can remove this check after adding type hints
-        extra_graph_params = {"random_k_deg": None}
-    NetworkCls, ncls_args = get_network(network_type, num_nodes, extra_graph_params)
-    network = NetworkCls(*ncls_args)
+def start_worker(network, node_ids, settings_opts, ready_queue):
+    """Run the given nodes of the network as AsyncGossipServers, all on this process' event loop."""
+    print(f"Starting Gossip-Worker-{os.getpid()} with nodes:".ljust(36) + f" {node_ids[0]}-{node_ids[-1]}")
+    ready = False
+    def on_ready():
+        nonlocal ready
+        ready = True
+        ready_queue.put(None)
+    try:
+        servers = [AsyncGossipServer(gn_addr(node_id), get_peer_addrs(network.get_peers_for_node(node_id)),
+                                     **(settings_opts or {})) for node_id in node_ids]
+        asyncio.run(serve_many(servers, on_ready=on_ready))
+    except Exception as e:  # e.g. a port in use, or bad settings: don't leave the launcher waiting on this worker
+        if not ready:
+            ready_queue.put(f"Gossip-Worker-{os.getpid()} failed to start: {e!r}")
+        raise
+
+
+def start_workers(network, num_workers, settings_opts, pids_map):
+    """Start the network's nodes split evenly over num_workers processes, and wait until all nodes are serving."""
+    node_ids = sorted(network.G.nodes)
+    chunk_size = -(-len(node_ids) // min(num_workers, len(node_ids)))
+    chunks = [node_ids[i:i + chunk_size] for i in range(0, len(node_ids), chunk_size)]
+
+    started = time.perf_counter()
+    ready_queue = mp.Queue()
+    workers = [mp.Process(target=start_worker, args=(network, chunk, settings_opts, ready_queue)) for chunk in chunks]
+    for worker in workers:
+        worker.start()
+    pids_map["workers"] = {worker.pid: chunk for worker, chunk in zip(workers, chunks)}
+
+    # a worker killed before it could report (e.g. by the OOM killer) would otherwise leave us waiting forever
+    deadline = time.monotonic() + ASYNC_WORKER_START_TIMEOUT
+    num_ready = 0
+    for num_reported in range(len(workers)):
+        try:
+            error = ready_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            exited = [worker.pid for worker in workers if not worker.is_alive()]
+            print(f"{len(workers) - num_reported} of {len(workers)} workers not ready after "
+                  f"{ASYNC_WORKER_START_TIMEOUT:.0f}s" + (f"; exited: {', '.join(map(str, exited))}" if exited else ""))
+            break
+        if error is not None:
+            print(error)
+        else:
+            num_ready += 1
+    if num_ready == len(workers):
+        print(f"Gossip network of {len(node_ids)} nodes ready on {len(workers)} workers in {time.perf_counter() - started:.2f}s")
+    else:
+        print(f"Gossip network started with only {num_ready} of {len(workers)} workers ready")
+    return workers
+
+
+def start_network(network_type, num_nodes, extra_graph_params=None, plot=False, engine="threading", settings_opts=None,
+                  num_workers=None):
+    """Start a network with each node in a process of its own; or, given num_workers, with the nodes packed into that
+    many worker processes (one per CPU core if 0), each serving all of its nodes on one asyncio event loop."""
+    assert engine in {"threading", "asyncio"}, f"unknown server engine: {engine}"
+    network = build_network(network_type, num_nodes, extra_graph_params)
 
     pids_map = {}
-    subprocs = {node_id: mp.Process(target=start_server, args=(network, node_id)) for node_id in network.G.nodes}
-    for node_id, proc in subprocs.items():
-        proc.start()
-        pids_map[node_id] = proc.pid
+    if num_workers is not None:
+        subprocs = start_workers(network, num_workers or os.cpu_count(), settings_opts, pids_map)
+    else:
+        subprocs = [mp.Process(target=start_server, args=(network, node_id, engine, settings_opts)) for node_id in network.G.nodes]
+        for node_id, proc in zip(network.G.nodes, subprocs):
+            proc.start()
+            pids_map[node_id] = proc.pid
 
     if plot:
         plt_proc = plot_network(network, pids_map)
 
     sp.write_pids_map_to_file(pids_map)
-    for proc in subprocs.values():
+    for proc in subprocs:
         proc.join()
@@ -0,0 +1,123 @@
+"""Hammer one server with concurrent relays, and check its msgs_box kept exact counts; run with `python -m gossip.stress`.
+
+Usage:
+  stress [-m <msgs>] [-R <rounds>] [-k <peers>] [-r <relays>] [-n <node>] [-s <secs>]
+
+Options:
+  -m <msgs>    Number of new messages relayed on each round [default: 2]
+  -R <rounds>  Number of rounds [default: 500]
+  -k <peers>   Number of peers relaying every message at once, each on its own thread & connection [default: 16]
+  -r <relays>  Number of times each peer relays each message, which is also its relay limit [default: 3]
+  -n <node>    ID of the node under stress; its peers take the IDs right after it [default: 900]
+  -s <secs>    Thread switch interval of this process, which runs the server too; the default of 5ms lets a handler
+               process a whole frame before any other runs, hiding races [default: 0.00001]
+
+On every round, all peers wait on a barrier, then each relays the round's few messages r times in a single frame, so
+that the server's handlers all race on the same records at once. Every message is received exactly r times from each
+of k peers, so a store that doesn't lose any update ends up with every message received for the first time once,
+counted r times in & r times out with each peer, and saved with all of its k × r paths.
+"""
+
+import os, sys, time, random, threading
+from docopt import docopt
+
+from gossip.server import GossipServer
+from gossip.client import GossipClient
+from gossip.connection_pool import PeerConnectionPool
+from gossip.constants import LOCALHOST, PORTS_ORIGIN
+
+
+def start_server_thread(node_id, peer_ids):
+    server = GossipServer(f"{LOCALHOST}:{PORTS_ORIGIN + node_id}", [f"{LOCALHOST}:{PORTS_ORIGIN + p}" for p in peer_ids])
+    threading.Thread(target=server.start, daemon=True).start()
+    client = GossipClient(f"{LOCALHOST}:{PORTS_ORIGIN + node_id}")
+    while True:
+        try:
+            client.get_peers_info(get_ids=True)
+            return server
+        except OSError:
+            time.sleep(0.05)
+
+
+def relay_rounds(address, peer_id, round_msg_ids, num_relays, barrier, seed):
+    """Relay each round's messages num_relays times as the given peer, in random order, once all peers are ready."""
+    client = GossipClient(address, pool=PeerConnectionPool())
+    rng = random.Random(seed)
+    for msg_ids in round_msg_ids:
+        relays = [(num_relays, msg_id, [peer_id], [f"stress-msg-{msg_id}", 0], None)
+                  for msg_id in msg_ids for _ in range(num_relays)]
+        rng.shuffle(relays)
+        barrier.wait()
+        client.send_relays(relays)
+
+
+def wait_for_handlers(metrics, total_relays, idle_timeout=1.0):
+    # the last frames may still be in the server's handlers; metrics aren't exact, so don't wait on a lost update
+    last_seen, last_change = -1, time.monotonic()
+    while metrics.relays_in < total_relays and time.monotonic() - last_change < idle_timeout:
+        if metrics.relays_in != last_seen:
+            last_seen, last_change = metrics.relays_in, time.monotonic()
+        time.sleep(0.01)
+
+
+def check_msgs_box(ss, msg_ids, peer_ids, num_relays):
+    """The ways in which the server's msgs_box & metrics differ from what exact counting would leave them at."""
+    violations = []
+    if ss.metrics.first_receptions != len(msg_ids):
+        violations.append(f"{ss.metrics.first_receptions} first receptions of {len(msg_ids)} messages")
+    if len(ss.msgs_box) != len(msg_ids):
+        violations.append(f"{len(ss.msgs_box)} messages stored out of {len(msg_ids)}")
+    slots = [ss.get_peer_slot(p) for p in peer_ids]
+    # every peer but the relaying one gets a relay per reception, so each one's relay limit is always reached
+    expected_out = num_relays if len(peer_ids) > 1 else 0
+    for msg_id in msg_ids:
+        record = ss.msgs_box[msg_id] if msg_id in ss.msgs_box else None
+        if record is None:
+            continue
+        in_counts = [record.in_counts[s] if s < len(record.in_counts) else 0 for s in slots]
+        out_counts = [record.get_out_count(s) for s in slots]
+        if any(c != num_relays for c in in_counts) or any(c != expected_out for c in out_counts):
+            violations.append(f"{msg_id}: in {in_counts}, out {out_counts}")
+        elif len(record.in_paths) != len(peer_ids) * num_relays:  # one per relay, as all are within the limit
+            violations.append(f"{msg_id}: {len(record.in_paths)} paths")
+    return violations
+
+
+def main():
+    args = docopt(__doc__)
+    msgs_per_round, num_rounds, num_peers = int(args["-m"]), int(args["-R"]), int(args["-k"])
+    num_relays, node_id = int(args["-r"]), int(args["-n"])
+    peer_ids = list(range(node_id + 1, node_id + 1 + num_peers))
+    rng = random.Random(0)
+    round_msg_ids = [[f"{rng.getrandbits(128):032x}" for _ in range(msgs_per_round)] for _ in range(num_rounds)]
+    msg_ids = [msg_id for msg_ids in round_msg_ids for msg_id in msg_ids]
+    num_msgs = len(msg_ids)
+    sys.setswitchinterval(float(args["-s"]))
+
+    sys.stdout = open(os.devnull, "w")  # keep the server's banner out of the report
+    server = start_server_thread(node_id, peer_ids)
+    sys.stdout = sys.__stdout__
+    address = f"{LOCALHOST}:{PORTS_ORIGIN + node_id}"
+    barrier = threading.Barrier(num_peers)
+    threads = [threading.Thread(target=relay_rounds, args=(address, p, round_msg_ids, num_relays, barrier, p))
+               for p in peer_ids]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    total_relays = num_msgs * num_peers * num_relays
+    wait_for_handlers(server.ss.metrics, total_relays)
+    elapsed = time.perf_counter() - started
+
+    violations = check_msgs_box(server.ss, msg_ids, peer_ids, num_relays)
+    print(f"{total_relays} relays of {num_msgs} messages from {num_peers} concurrent peers in {elapsed:.2f}s "
+          f"({total_relays / elapsed:.0f} relays/s)")
+    for v in violations[:20]:
+        print(f"* {v}")
+    print(f"{len(violations)} violations" if violations else "OK: every count is exact")
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
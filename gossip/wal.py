@@ -0,0 +1,424 @@
+"""A write-ahead log & snapshots of a server's msgs_box, so that a restarted node recovers its messages.
+
+Updating a message only marks it dirty. Every WAL_FLUSH_INTERVAL, a background thread appends the current records
+of all dirty messages to the log with a single write & fsync (a group commit), so a message updated by a burst of
+relays is only logged once; a message evicted from a bounded msgs_box is logged as a tombstone instead. Every
+WAL_SNAPSHOT_INTERVAL, or as soon as the log outgrows WAL_SNAPSHOT_BYTES, it's compacted into a snapshot: every
+record, followed by an index of their IDs, sorted, then the tombstones.
+
+Recovery doesn't read any records back in: the snapshot is memory-mapped, and answers whether the node has seen a
+message by a binary search of its index; only the (memory-mapped) logs written since are scanned, to index their
+records. Records are then loaded ("thawed") from the mapped files as the msgs_box first needs them; a bounded msgs_box loads
+them all at once instead, so that they're held to its bounds (see BoundedMessageStore.attach_log).
+
+All files of a node are in its own directory, numbered by generation: snapshot-<g>.bin holds the state as of the
+start of wal-<g>.log, and the logs of generation g and after replay, in order, on top of it.
+"""
+
+import os, re, mmap, struct, threading, time, zlib
+from array import array
+
+from gossip.msg_store import MessageRecord
+from gossip.paths import PathTrie
+from gossip.dissemination import Dissemination, DEFAULT_DISSEMINATION, STRATEGIES
+from gossip.constants import MSG_ID_SIZE, WAL_FLUSH_INTERVAL, WAL_SNAPSHOT_INTERVAL, WAL_SNAPSHOT_BYTES
+
+
+# a record: its fixed-width header, then its content (UTF-8), (peer ID, in count, out count) triples & PathTrie array;
+# the header's times are received_ns, the time the record was packed (as of which it's up to date) & origin_ts
+RECORD_HEADER = struct.Struct(f"<{MSG_ID_SIZE}sqqqBBHHIII")
+IS_UNREAD, HAS_BODY, EVICTED = 1, 2, 4     # a record flagged EVICTED is a tombstone: its header alone
+# a log frame: the record's length & CRC-32, then the record; a torn or corrupt frame ends the log
+LOG_FRAME = struct.Struct("<II")
+
+FILE_NAME_RE = re.compile(r"(snapshot|wal)-(\d+)\.(bin|log)$")
+
+
+def pack_record(msg_id, msg_attrs, slot_peers):
+    """The record as bytes; peers are stored by ID rather than by slot, as slots don't outlive the process."""
+    content = msg_attrs.content.encode() if msg_attrs.content is not None else b""
+    counts = array("I")
+    for slot, peer_id in slot_peers.items():
+        in_count = msg_attrs.in_counts[slot] if slot < len(msg_attrs.in_counts) else 0
+        out_count = msg_attrs.get_out_count(slot)
+        if in_count or out_count:
+            counts.extend((peer_id, in_count, out_count))
+    paths = msg_attrs.in_paths.to_array()
+    d = msg_attrs.dissemination
+    strategy = 0 if d == DEFAULT_DISSEMINATION else STRATEGIES.index(d.strategy) + 1
+    flags = (IS_UNREAD if msg_attrs.is_unread else 0) | (HAS_BODY if msg_attrs.content is not None else 0)
+    header = RECORD_HEADER.pack(bytes.fromhex(msg_id), msg_attrs.received_ns, time.time_ns(), msg_attrs.origin_ts or 0,
+                                flags, strategy, d.fanout, d.max_hops, len(content), len(counts) // 3, len(paths))
+    return b"".join((header, content, counts.tobytes(), paths.tobytes()))
+
+
+def pack_tombstone(msg_id):
+    """The record of a message evicted from the msgs_box, so that it isn't recovered, nor accepted again."""
+    return RECORD_HEADER.pack(bytes.fromhex(msg_id), 0, time.time_ns(), 0, EVICTED, 0, 0, 0, 0, 0, 0)
+
+
+def get_updated_ns(data, offset=0):
+    """The time the record at the offset was packed, i.e. the message was last updated (as of a flush)."""
+    return RECORD_HEADER.unpack_from(data, offset)[2]
+
+
+def unpack_record(data, get_peer_slot):
+    (_, received_ns, _, origin_ts, flags, strategy, fanout, max_hops, content_len, num_counts,
+     paths_len) = RECORD_HEADER.unpack_from(data)
+    pos = RECORD_HEADER.size
+    msg_attrs = MessageRecord(0, received_ns)
+    if flags & HAS_BODY:
+        msg_attrs.content, msg_attrs.origin_ts = data[pos:pos + content_len].decode(), origin_ts
+    msg_attrs.is_unread = bool(flags & IS_UNREAD)
+    if strategy:
+        msg_attrs.dissemination = Dissemination(STRATEGIES[strategy - 1], fanout, max_hops)
+    pos += content_len
+
+    counts = array("I")
+    counts.frombytes(data[pos:pos + counts.itemsize * 3 * num_counts])
+    pos += counts.itemsize * 3 * num_counts
+    for peer_id, in_count, out_count in zip(counts[0::3], counts[1::3], counts[2::3]):
+        msg_attrs.set_counts(get_peer_slot(peer_id), in_count, out_count)
+
+    paths = array("i")
+    paths.frombytes(data[pos:pos + paths.itemsize * paths_len])
+    msg_attrs.in_paths = PathTrie.from_array(paths)
+    return msg_attrs
+
+
+class Snapshot:
+    """A memory-mapped snapshot file: a header, the records of all messages, the index of their IDs, sorted, then the
+    IDs of the messages evicted (tombstones), oldest first."""
+
+    HEADER = struct.Struct("<4sQQQ")    # magic, number of records, offset of the index, number of tombstones
+    INDEX_ENTRY = struct.Struct(f"<{MSG_ID_SIZE}sQ")   # message ID, offset of its length-prefixed record
+    RECORD_LEN = struct.Struct("<I")
+    MAGIC = b"GSS2"
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.num_records, self._index_offset, self.num_tombstones = Snapshot.HEADER.unpack_from(self._mm)
+        assert magic == Snapshot.MAGIC, f"not a snapshot: {path}"
+
+    def find(self, msg_id_bytes):
+        """The offset of the message's record, by binary search of the index; None if it isn't in the snapshot."""
+        mm, E, base = self._mm, Snapshot.INDEX_ENTRY.size, self._index_offset
+        lo, hi = 0, self.num_records
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if mm[base + mid * E:base + mid * E + MSG_ID_SIZE] < msg_id_bytes:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.num_records and mm[base + lo * E:base + lo * E + MSG_ID_SIZE] == msg_id_bytes:
+            return Snapshot.INDEX_ENTRY.unpack_from(mm, base + lo * E)[1]
+        return None
+
+    def read_record(self, offset):
+        (length,) = Snapshot.RECORD_LEN.unpack_from(self._mm, offset)
+        start = offset + Snapshot.RECORD_LEN.size
+        return self._mm[start:start + length]
+
+    def iter_index(self):
+        """The (msg_id bytes, record offset) of every message in the snapshot."""
+        E = Snapshot.INDEX_ENTRY.size
+        for pos in range(self._index_offset, self._index_offset + self.num_records * E, E):
+            yield Snapshot.INDEX_ENTRY.unpack_from(self._mm, pos)
+
+    def get_tombstones(self):
+        start = self._index_offset + self.num_records * Snapshot.INDEX_ENTRY.size
+        return [self._mm[pos:pos + MSG_ID_SIZE].hex()
+                for pos in range(start, start + self.num_tombstones * MSG_ID_SIZE, MSG_ID_SIZE)]
+
+    @staticmethod
+    def write(path, records, tombstones=()):
+        """Atomically write a snapshot of (msg_id bytes, record bytes) pairs, and of the msg_id bytes of evicted
+        messages; returns the number of records."""
+        tmp_path, index, offset = path + ".tmp", [], Snapshot.HEADER.size
+        with open(tmp_path, "wb") as f:
+            f.write(Snapshot.HEADER.pack(Snapshot.MAGIC, 0, 0, 0))
+            for msg_id_bytes, record in records:
+                f.write(Snapshot.RECORD_LEN.pack(len(record)))
+                f.write(record)
+                index.append((msg_id_bytes, offset))
+                offset += Snapshot.RECORD_LEN.size + len(record)
+            index.sort()
+            f.write(b"".join(Snapshot.INDEX_ENTRY.pack(*entry) for entry in index))
+            tombstones = b"".join(tombstones)
+            f.write(tombstones)
+            f.seek(0)
+            f.write(Snapshot.HEADER.pack(Snapshot.MAGIC, len(index), offset, len(tombstones) // MSG_ID_SIZE))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return len(index)
+
+
+def scan_log(path):
+    """Memory-map a log, and index the last record of each message in it; returns (mmap, {msg_id: (offset, length)},
+    {msg_id: None} of the messages whose last record is a tombstone, oldest first)."""
+    index, evicted = {}, {}
+    if os.path.getsize(path) == 0:
+        return None, index, evicted
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    pos = 0
+    while pos + LOG_FRAME.size <= len(mm):
+        length, crc = LOG_FRAME.unpack_from(mm, pos)
+        start = pos + LOG_FRAME.size
+        if start + length > len(mm) or zlib.crc32(mm[start:start + length]) != crc:
+            break   # torn by a crash mid-write: all complete frames before it still count
+        msg_id = mm[start:start + MSG_ID_SIZE].hex()
+        if RECORD_HEADER.unpack_from(mm, start)[4] & EVICTED:
+            index.pop(msg_id, None)
+            evicted[msg_id] = None
+        else:
+            evicted.pop(msg_id, None)   # accepted again, once its tombstone was dropped
+            index[msg_id] = (start, length)
+        pos = start + length
+    return mm, index, evicted
+
+
+class MessageLog:
+    """Persists a server's msgs_box in its own directory under data_dir, and recovers it from there on creation."""
+
+    def __init__(self, ss, data_dir, flush_interval=WAL_FLUSH_INTERVAL, snapshot_interval=WAL_SNAPSHOT_INTERVAL,
+                 snapshot_bytes=WAL_SNAPSHOT_BYTES):
+        self.ss = ss
+        self.dir = os.path.join(data_dir, f"node-{ss.node_id}")
+        self.flush_interval = flush_interval
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_bytes = snapshot_bytes
+        self.thaw_lock = threading.Lock()   # held while a record is thawed, or the cold records are switched over
+        self.commits = self.records_logged = self.snapshots = self.failed = 0
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+        self._write_lock = threading.RLock()    # serializes flushes & snapshots
+        self._stopped = threading.Event()
+        self._snapshot_at = time.monotonic()
+
+        started = time.perf_counter()
+        os.makedirs(self.dir, exist_ok=True)
+        self._recover()
+        ss.msgs_box.attach_log(self)
+        self.recovery_secs = time.perf_counter() - started
+
+    @property
+    def num_cold(self):
+        """The number of messages recovered, but not thawed yet."""
+        return max(0, self._num_cold - self._num_thawed)
+
+    def has_cold(self, msg_id):
+        return msg_id in self._log_index or (self._snapshot is not None and msg_id not in self._evicted and
+                                             self._snapshot.find(bytes.fromhex(msg_id)) is not None)
+
+    def thaw(self, msg_id):
+        """Load a recovered message's record; must be called holding the thaw_lock."""
+        loc = self._log_index.get(msg_id)
+        if loc is not None:
+            mm, offset, length = loc
+            data = mm[offset:offset + length]
+        else:
+            offset = self._snapshot.find(bytes.fromhex(msg_id)) if self._snapshot is not None else None
+            if offset is None:
+                raise KeyError(msg_id)
+            data = self._snapshot.read_record(offset)
+        self._num_thawed += 1
+        return unpack_record(data, self.ss.get_peer_slot)
+
+    def get_cold_ids(self):
+        """The IDs of all messages recovered, whether thawed since or not."""
+        log_ids = list(self._log_index)
+        snapshot_ids = (msg_id_bytes.hex() for msg_id_bytes, _ in self._snapshot.iter_index()) if self._snapshot else ()
+        return log_ids + [msg_id for msg_id in snapshot_ids if msg_id not in self._log_index and
+                          msg_id not in self._evicted]
+
+    def get_evicted_ids(self):
+        """The IDs of the messages recovered as evicted, oldest first."""
+        snapshot_ids = self._snapshot.get_tombstones() if self._snapshot is not None else []
+        return [msg_id for msg_id in snapshot_ids if msg_id not in self._log_index] + list(self._evicted)
+
+    def iter_cold_by_age(self):
+        """Thaw every message recovered, least recently updated first; yields (msg_id, record, updated_ns)."""
+        ages = []
+        for msg_id in self.get_cold_ids():
+            loc = self._log_index.get(msg_id)
+            if loc is not None:
+                mm, offset, _ = loc
+                ages.append((get_updated_ns(mm, offset), msg_id))
+            else:
+                offset = self._snapshot.find(bytes.fromhex(msg_id))
+                ages.append((get_updated_ns(self._snapshot.read_record(offset)), msg_id))
+        ages.sort()
+        for updated_ns, msg_id in ages:
+            yield msg_id, self.thaw(msg_id), updated_ns
+
+    def drop_cold(self):
+        """Forget the recovered messages, once the msgs_box has loaded all those it keeps; the files they're in are
+        still replayed on recovery until the next snapshot, which only holds the loaded ones."""
+        self._snapshot, self._log_index, self._evicted = None, {}, {}
+        self._num_cold = self._num_thawed = 0
+
+    def mark(self, msg_id):
+        with self._dirty_lock:
+            self._dirty.add(msg_id)
+
+    def start(self):
+        threading.Thread(target=self._run, name="wal", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        with self._write_lock:
+            self.flush()
+            self._log_file.close()
+            self._log_file = None
+
+    def get_stats(self):
+        return {
+            "commits":     self.commits,
+            "records":     self.records_logged,
+            "log_bytes":   self._log_bytes,
+            "snapshots":   self.snapshots,
+            "cold":        self.num_cold,
+            "failed":      self.failed,
+            "recovery_ms": self.recovery_secs * 1000,
+        }
+
+    def flush(self):
+        """Group-commit the records of all messages updated since the last flush, in one write & fsync."""
+        with self._write_lock:
+            with self._dirty_lock:
+                dirty, self._dirty = self._dirty, set()
+            if not dirty or self._log_file is None:     # or stopped
+                return
+            slot_peers = self._get_slot_peers()
+            frames, num_records = bytearray(), 0
+            for msg_id in dirty:
+                record = self._pack_loaded(msg_id, slot_peers)
+                if record is None and self.ss.msgs_box.is_evicted(msg_id):
+                    record = pack_tombstone(msg_id)
+                if record is not None:
+                    frames += LOG_FRAME.pack(len(record), zlib.crc32(record))
+                    frames += record
+                    num_records += 1
+            self._log_file.write(frames)
+            self._log_file.flush()
+            os.fsync(self._log_file.fileno())
+            self._log_bytes += len(frames)
+            self.commits += 1
+            self.records_logged += num_records
+
+    def snapshot(self):
+        """Compact the previous snapshot & every log since into a new snapshot, then delete them."""
+        with self._write_lock:
+            if self._log_file is not None:
+                self._snapshot_locked()
+
+    def _snapshot_locked(self):
+        self.flush()
+        self._snapshot_at = time.monotonic()
+        gen = self._gen + 1
+        self._open_log(gen)     # later updates are logged on top of the new snapshot
+        num_thawed_before = self._num_thawed
+        loaded_ids = self.ss.msgs_box.get_loaded_ids()
+        num_written_loaded = 0
+
+        def iter_records():
+            nonlocal num_written_loaded
+            slot_peers = self._get_slot_peers()
+            for msg_id in loaded_ids:
+                record = self._pack_loaded(msg_id, slot_peers)
+                if record is not None:
+                    num_written_loaded += 1
+                    yield bytes.fromhex(msg_id), record
+            # the messages never thawed are copied over as they are; those thawed since are copied too, but then
+            # they're counted as thawed from the new snapshot as well
+            loaded = set(loaded_ids)
+            for msg_id, loc in list(self._log_index.items()):
+                if msg_id not in loaded and not self.ss.msgs_box.is_evicted(msg_id):
+                    mm, offset, length = loc
+                    yield bytes.fromhex(msg_id), mm[offset:offset + length]
+            if self._snapshot is not None:
+                for msg_id_bytes, offset in self._snapshot.iter_index():
+                    msg_id = msg_id_bytes.hex()
+                    if msg_id not in loaded and msg_id not in self._log_index and msg_id not in self._evicted:
+                        yield msg_id_bytes, self._snapshot.read_record(offset)
+
+        # an unbounded msgs_box keeps no tombstones of its own, but still passes those recovered on
+        tombstones = dict.fromkeys(self.get_evicted_ids() + self.ss.msgs_box.get_evicted_ids())
+        path = self._path("snapshot", gen)
+        num_records = Snapshot.write(path, iter_records(), (bytes.fromhex(msg_id) for msg_id in tombstones))
+        with self.thaw_lock:
+            self._snapshot, self._log_index, self._evicted = Snapshot(path), {}, {}
+            self._num_cold = num_records
+            self._num_thawed = num_written_loaded + (self._num_thawed - num_thawed_before)
+        self._delete_files_before(gen)
+        self._log_bytes = 0
+        self.snapshots += 1
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+                if self._log_bytes >= self.snapshot_bytes or \
+                        (self._log_bytes and time.monotonic() - self._snapshot_at >= self.snapshot_interval):
+                    self.snapshot()
+            except OSError:
+                self.failed += 1
+
+    def _recover(self):
+        gens = {"snapshot": [], "wal": []}
+        for name in os.listdir(self.dir):
+            if m := FILE_NAME_RE.match(name):
+                gens[m.group(1)].append(int(m.group(2)))
+        snapshot_gen = max(gens["snapshot"], default=0)
+        self._snapshot = Snapshot(self._path("snapshot", snapshot_gen)) if gens["snapshot"] else None
+
+        # a message's latest record, or tombstone, is in the latest log it was written to
+        self._log_index, self._evicted, self._log_bytes = {}, {}, 0
+        for gen in sorted(g for g in gens["wal"] if g >= snapshot_gen):
+            path = self._path("wal", gen)
+            mm, index, evicted = scan_log(path)
+            for msg_id in index:
+                self._evicted.pop(msg_id, None)
+            for msg_id in evicted:
+                self._log_index.pop(msg_id, None)
+            self._log_index.update((msg_id, (mm, *loc)) for msg_id, loc in index.items())
+            self._evicted.update(evicted)
+            self._log_bytes += os.path.getsize(path)
+
+        def in_snapshot(msg_id):
+            return self._snapshot is not None and self._snapshot.find(bytes.fromhex(msg_id)) is not None
+
+        num_logged_only = sum(1 for msg_id in self._log_index if not in_snapshot(msg_id))
+        num_evicted_since = sum(1 for msg_id in self._evicted if in_snapshot(msg_id))
+        self._num_cold = (self._snapshot.num_records if self._snapshot else 0) + num_logged_only - num_evicted_since
+        self._num_thawed = 0
+        # logging resumes in a new file, rather than after a possibly torn end of the last one
+        self._open_log(max(gens["snapshot"] + gens["wal"], default=0) + 1)
+        self._delete_files_before(snapshot_gen)
+
+    def _open_log(self, gen):
+        if getattr(self, "_log_file", None) is not None:
+            self._log_file.close()
+        self._gen = gen
+        self._log_file = open(self._path("wal", gen), "ab")
+
+    def _delete_files_before(self, gen):
+        # files still mapped in memory remain readable after they're deleted
+        for name in os.listdir(self.dir):
+            m = FILE_NAME_RE.match(name)
+            if (m and int(m.group(2)) < gen) or name.endswith(".tmp"):
+                os.remove(os.path.join(self.dir, name))
+
+    def _pack_loaded(self, msg_id, slot_peers):
+        with self.ss.msgs_box.lock_for(msg_id):
+            msg_attrs = self.ss.msgs_box.get_loaded(msg_id)
+            return pack_record(msg_id, msg_attrs, slot_peers) if msg_attrs is not None else None
+
+    def _get_slot_peers(self):
+        return {slot: peer_id for peer_id, slot in list(self.ss.peer_slots.items())}
+
+    def _path(self, kind, gen):
+        return os.path.join(self.dir, f"{kind}-{gen:08d}.{'bin' if kind == 'snapshot' else 'log'}")
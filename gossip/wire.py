@@ -0,0 +1,160 @@
+"""Framing of the commands sent between gossip nodes.
+
+Every connection starts out speaking the newline-framed text protocol. A peer connection may switch to the
+binary protocol by sending PROTO_BINARY_REQUEST; if the server answers with PROTO_BINARY_ACK, every subsequent
+command on that connection is sent as a length-prefixed binary frame:
+
+    header:   frame type (1 byte) | payload length (4 bytes, big-endian)
+    payload:  FRAME_CMD     -> a text command line, as UTF-8
+              FRAME_RELAYS  -> varint relay count, then for each relay:
+                               varint relay limit | message ID (MSG_ID_SIZE bytes) | varint path length, varint node IDs
+                               | varint body length + 1, or 0 when the relay carries no body | body bytes | varint timestamp
+                               | varint strategy index + 1, then varint fanout and varint max hops; or 0 for the default
+"""
+
+import json, struct
+
+from gossip.constants import MSG_ID_SIZE, WIRE_MAX_FRAME_BYTES
+
+
+PROTO_BINARY_REQUEST = b"/PROTO:binary\n"
+PROTO_BINARY_ACK     = b"/PROTO:binary\n"
+
+FRAME_HEADER  = struct.Struct("!BI")
+FRAME_CMD     = 0
+FRAME_RELAYS  = 1
+
+
+def encode_cmd(cmd_line: str, proto="text"):
+    if proto == "text":
+        return bytes(cmd_line, "utf-8")
+    return pack_frame(FRAME_CMD, bytes(cmd_line.rstrip("\n"), "utf-8"))
+
+
+def encode_relays(relays, proto="text"):
+    """Encode a list of (relay_limit, msg_id, node_path, body, dissemination) relays as a single command frame.
+
+    The body is either None, or the message's [content, origin_ts] pair; the dissemination is either None (the
+    default), or the message's [strategy index, fanout, max_hops] (see Dissemination.to_wire).
+    """
+    if proto == "text":
+        return bytes(encode_relays_text(relays), "utf-8")
+    return pack_frame(FRAME_RELAYS, pack_relays(relays))
+
+
+def encode_relays_text(relays):
+    if len(relays) == 1:
+        relay_limit, msg_id, node_path, body, dissemination = relays[0]
+        relay_data = [msg_id, node_path]
+        if body is not None or dissemination is not None:
+            relay_data.append(body)
+        if dissemination is not None:
+            relay_data.append(dissemination)
+        return f"/RELAY:{relay_limit}|{json.dumps(relay_data)}\n"
+    return f"/RELAYS:{json.dumps(relays)}\n"
+
+
+def pack_frame(frame_type, payload: bytes):
+    return FRAME_HEADER.pack(frame_type, len(payload)) + payload
+
+
+def read_frame(rfile):
+    """Read the next (frame_type, payload) pair from a binary file object; None once the stream has ended.
+
+    A frame longer than WIRE_MAX_FRAME_BYTES ends the stream too: its length is only trusted up to there, so that a
+    corrupt or hostile header can't make the reader buffer gigabytes, and the connection gets dropped instead.
+    """
+    header = rfile.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None
+    frame_type, length = FRAME_HEADER.unpack(header)
+    if length > WIRE_MAX_FRAME_BYTES:
+        return None
+    payload = rfile.read(length)
+    if len(payload) < length:
+        return None
+    return frame_type, payload
+
+
+async def read_frame_async(reader):
+    """Like read_frame, but from an asyncio StreamReader."""
+    try:
+        frame_type, length = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+        if length > WIRE_MAX_FRAME_BYTES:
+            return None
+        return frame_type, await reader.readexactly(length)
+    except EOFError:    # asyncio.IncompleteReadError
+        return None
+
+
+def pack_relays(relays):
+    buf = bytearray()
+    _pack_varint(buf, len(relays))
+    for relay_limit, msg_id, node_path, body, dissemination in relays:
+        _pack_varint(buf, relay_limit)
+        buf += bytes.fromhex(msg_id)
+        _pack_varint(buf, len(node_path))
+        for node_id in node_path:
+            _pack_varint(buf, node_id)
+        if body is None:
+            _pack_varint(buf, 0)
+        else:
+            content, origin_ts = body
+            content_bytes = bytes(content, "utf-8")
+            _pack_varint(buf, len(content_bytes) + 1)
+            buf += content_bytes
+            _pack_varint(buf, origin_ts)
+        if dissemination is None:
+            _pack_varint(buf, 0)
+        else:
+            strategy_idx, fanout, max_hops = dissemination
+            _pack_varint(buf, strategy_idx + 1)
+            _pack_varint(buf, fanout)
+            _pack_varint(buf, max_hops)
+    return bytes(buf)
+
+
+def unpack_relays(payload: bytes):
+    relays = []
+    count, pos = _unpack_varint(payload, 0)
+    for _ in range(count):
+        relay_limit, pos = _unpack_varint(payload, pos)
+        msg_id, pos = payload[pos:pos + MSG_ID_SIZE].hex(), pos + MSG_ID_SIZE
+        path_len, pos = _unpack_varint(payload, pos)
+        node_path = []
+        for _ in range(path_len):
+            node_id, pos = _unpack_varint(payload, pos)
+            node_path.append(node_id)
+        body_len, pos = _unpack_varint(payload, pos)
+        body = None
+        if body_len:
+            content, pos = payload[pos:pos + body_len - 1].decode(), pos + body_len - 1
+            origin_ts, pos = _unpack_varint(payload, pos)
+            body = [content, origin_ts]
+        strategy_code, pos = _unpack_varint(payload, pos)
+        dissemination = None
+        if strategy_code:
+            fanout, pos = _unpack_varint(payload, pos)
+            max_hops, pos = _unpack_varint(payload, pos)
+            dissemination = [strategy_code - 1, fanout, max_hops]
+        relays.append((relay_limit, msg_id, node_path, body, dissemination))
+    return relays
+
+
+def _pack_varint(buf: bytearray, n: int):
+    # unsigned LEB128: 7 bits per byte, least significant group first, high bit set on all but the last byte
+    while n > 0x7f:
+        buf.append((n & 0x7f) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def _unpack_varint(data: bytes, pos: int):
+    n = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
@@ -0,0 +1,41 @@
+import threading, time, unittest
+
+from gossip.aio_server import AsyncGossipServer
+from gossip.client import GossipClient
+from gossip.constants import LOCALHOST, PORTS_ORIGIN
+
+
+class TestAsyncGossipServer(unittest.TestCase):
+
+    NODE_ID = 951
+
+    def setUp(self):
+        self.server = AsyncGossipServer(f"{LOCALHOST}:{PORTS_ORIGIN + self.NODE_ID}", [])
+        self.thread = threading.Thread(target=self.server.start, daemon=True)
+        self.thread.start()
+        self.client = GossipClient(f"{LOCALHOST}:{PORTS_ORIGIN + self.NODE_ID}")
+        for _ in range(100):
+            try:
+                self.client.get_store_stats()
+                break
+            except OSError:
+                time.sleep(0.05)
+
+    def tearDown(self):
+        self.client.shutdown()
+        self.thread.join(timeout=5)
+
+    def test_push_longer_than_default_stream_limit(self):
+        # a 1000-message /PUSH line is well over asyncio's default 64 KiB StreamReader limit
+        msgs = [[f"{i:032x}", f"message {i} " + "x" * 100, i, [1]] for i in range(1000)]
+        self.client.push_msgs(msgs)
+        # the push gets no response, and the stats come over another connection, which may be served first
+        for _ in range(100):
+            if (entries := self.client.get_store_stats()["entries"]) == 1000:
+                break
+            time.sleep(0.05)
+        self.assertEqual(entries, 1000)
+
+
+if __name__ == "__main__":
+    unittest.main()